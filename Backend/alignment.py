@@ -0,0 +1,194 @@
+import logging
+import math
+import os
+import re
+from collections import namedtuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Solutions this many places either side of the expected one are candidates for a question
+ALIGNMENT_WINDOW = int(os.getenv("ALIGNMENT_WINDOW", "10"))
+# Least word similarity for matching a question to a solution by text alone
+ALIGNMENT_MIN_SIMILARITY = float(os.getenv("ALIGNMENT_MIN_SIMILARITY", "0.2"))
+# Matches below this confidence are reported for review
+ALIGNMENT_MIN_CONFIDENCE = float(os.getenv("ALIGNMENT_MIN_CONFIDENCE", "0.6"))
+
+WORD_PATTERN = re.compile(r"[a-z]{3,}")
+STOP_WORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has him his how its may new now see two who "
+    "did get let say she too use that with have this will your from they been than them then were what when which "
+    "while would there their these those into also each marks mark answer question correct following given".split()
+)
+
+# solution_number and solution_label are None when no solution was matched;
+# method is 'number', 'similarity', 'position' or 'none'
+Match = namedtuple("Match", ["text", "solution_number", "solution_label", "confidence", "method"])
+
+
+def words(text):
+    return frozenset(WORD_PATTERN.findall(text.lower())) - STOP_WORDS
+
+
+# Cosine similarity of two word sets
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / math.sqrt(len(a) * len(b))
+
+
+class AlignmentIndex:
+    """Matches questions to solutions, read lazily from segment records.
+
+    Questions are matched in paper order. Each one is expected to go with
+    the solution after the last one matched; candidates are the unmatched
+    solutions within window places of that one. A candidate with the same
+    printed number wins, with full confidence at the expected place and a
+    little less the further away it is. Otherwise the candidate whose words
+    are most like the question's is taken if similar enough, with the
+    similarity as confidence; solutions numbered like nearby questions are
+    left for those. Unnumbered blocks only go with an unnumbered block at
+    the expected place.
+
+    Each question looks at a fixed number of candidates, so a paper is
+    aligned in linear time, and solutions are only read as far as the
+    window ahead of the last match.
+    """
+
+    def __init__(self, solutions, window=ALIGNMENT_WINDOW, min_similarity=ALIGNMENT_MIN_SIMILARITY,
+                 min_confidence=ALIGNMENT_MIN_CONFIDENCE):
+        self.solutions = iter(solutions)
+        self.window = window
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        # Unmatched solutions read so far, by position
+        self.records = {}
+        self.read = 0
+        self.exhausted = False
+        self.expected = 0
+        # Places below this have left the window
+        self.evicted = 0
+        self.words = {}
+        self.low_confidence = []
+        self.unmatched_solutions = 0
+        # Matches by method, added to the metrics by report()
+        self.methods = {}
+
+    def _read_to(self, position):
+        while self.read <= position and not self.exhausted:
+            record = next(self.solutions, None)
+            if record is None:
+                self.exhausted = True
+                break
+            self.records[self.read] = record
+            self.read += 1
+
+    def _words(self, position):
+        if position not in self.words:
+            self.words[position] = words(self.records[position]['text'])
+        return self.words[position]
+
+    def _take(self, position, question, confidence, method):
+        record = self.records.pop(position)
+        self.words.pop(position, None)
+        # Only a matching number moves the expected place far; a match by
+        # words away from it may be wrong and should not drag the rest along
+        if method == 'number' or position == self.expected:
+            self.expected = position + 1
+        # Solutions left behind the window can no longer be matched. Each
+        # place is checked once, as the window only moves past it forward.
+        while self.evicted < self.expected - self.window:
+            if self.records.pop(self.evicted, None) is not None:
+                self.words.pop(self.evicted, None)
+                self.unmatched_solutions += 1
+            self.evicted += 1
+        return self._record(question, Match(record['text'], record['number'], record['label'], confidence, method))
+
+    def _record(self, question, match):
+        self.methods[match.method] = self.methods.get(match.method, 0) + 1
+        # Unnumbered blocks without a solution are headers rather than questions
+        if match.confidence < self.min_confidence and (question['label'] is not None or match.method != 'none'):
+            self.low_confidence.append((question['number'], question['label'], match))
+        return match
+
+    def _near_label(self, candidate_label, label):
+        # Twice the window, as extra blocks put numbers further apart than places
+        return candidate_label is not None and abs(int(candidate_label) - int(label)) <= 2 * self.window
+
+    def match(self, question):
+        self._read_to(self.expected + self.window)
+        label = question['label']
+        # The usual case: the next solution has the question's number
+        expected = self.records.get(self.expected)
+        if label is not None and expected is not None and expected['label'] == label:
+            return self._take(self.expected, question, 1.0, 'number')
+
+        candidates = sorted(
+            (p for p in self.records if abs(p - self.expected) <= self.window),
+            key=lambda p: abs(p - self.expected)
+        )
+
+        if label is not None:
+            for position in candidates:
+                if self.records[position]['label'] == label:
+                    distance = abs(position - self.expected)
+                    return self._take(position, question, round(max(0.6, 1 - 0.05 * distance), 2), 'number')
+
+        if label is None:
+            # Blocks without a printed number, such as instructions before the
+            # first question, only go with an unnumbered block at the same place
+            if expected is not None and expected['label'] is None:
+                return self._take(self.expected, question, 0.3, 'position')
+        else:
+            # Solutions numbered like the neighbouring questions belong to them
+            candidates = [p for p in candidates if not self._near_label(self.records[p]['label'], label)]
+            if candidates:
+                question_words = words(question['text'])
+                # Ties go to the candidate nearest the expected place
+                position = max(candidates, key=lambda p: similarity(question_words, self._words(p)))
+                score = similarity(question_words, self._words(position))
+                if score >= self.min_similarity:
+                    return self._take(position, question, round(min(score, 0.9), 2), 'similarity')
+
+        return self._record(question, Match('', None, None, 0.0, 'none'))
+
+    def report(self, paper=None):
+        # Log the matches that need review, add them to the job's metrics as
+        # review entries and count the matches by method; call once every
+        # question is matched
+        self._read_to(math.inf)
+        self.unmatched_solutions += len(self.records)
+        self.records.clear()
+        self.words.clear()
+        if self.low_confidence:
+            logger.warning(f"{len(self.low_confidence)} questions were matched to a solution with low confidence, "
+                           "check them: " + ", ".join(_describe(*entry) for entry in self.low_confidence))
+        for question_number, question_label, match in self.low_confidence:
+            metrics.review({
+                "paper": paper,
+                "question": _block(question_number, question_label, "Q"),
+                "solution": _block(match.solution_number, match.solution_label, "S")
+                if match.solution_number is not None else None,
+                "method": match.method,
+                "confidence": match.confidence,
+            })
+        for method, count in self.methods.items():
+            metrics.increment(f"alignment.{method}", count)
+        if self.low_confidence:
+            metrics.increment("alignment.low_confidence", len(self.low_confidence))
+        if self.unmatched_solutions:
+            metrics.increment("alignment.unmatched_solutions", self.unmatched_solutions)
+            logger.warning(f"{self.unmatched_solutions} solutions matched no question")
+
+
+def _block(number, label, prefix):
+    return f"{prefix}{label}" if label is not None else f"block {number}"
+
+
+def _describe(question_number, question_label, match):
+    question = _block(question_number, question_label, "Q")
+    if match.solution_number is None:
+        return f"{question} (no solution)"
+    solution = _block(match.solution_number, match.solution_label, "S")
+    return f"{question} -> {solution} ({match.method} {match.confidence:.2f})"
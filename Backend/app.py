@@ -1,23 +1,50 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, url_for
 import os
-import requests
 import json
 import time
+import numpy as np
 import pandas as pd
 import re
 import openai
 from flask_cors import CORS
 import tempfile
+import difflib
+import logging
+import shutil
+import threading
+import contextlib
+import itertools
+import zipfile
+from werkzeug.datastructures import FileStorage
+from concurrent.futures import Future, ThreadPoolExecutor
+from caches import gpt_cache, mathpix_cache
+from checkpoints import CheckpointJournal
+import metrics
+from mathpix import (MATHPIX_MAX_CONCURRENT, MATHPIX_PAGES_PER_CHUNK, MathpixError, PagedText, StreamingReplacer,
+                     client as mathpix_client, count_pdf_pages, mathpix_slots, page_range_count, page_ranges,
+                     poller as mathpix_poller, seekable_stream)
+from excel_writer import StreamingExcelWriter
+from enrichment import GPT_MAX_WORKERS, default_limiter, enrich_rows
+from jobs import JobRunner, JobStore, QueueFull
+from segmenter import segment_file, segment_lines
+from alignment import AlignmentIndex
 
-# Mathpix API credentials
+# API credentials (the Mathpix ones are read by mathpix.py)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-MATHPIX_API_KEY = os.getenv("MATHPIX_API_KEY")
-MATHPIX_APP_ID = os.getenv("MATHPIX_APP_ID")
+
+# LOG_LEVEL=WARNING keeps only problems; DEBUG adds every GPT response and poll
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 openai.api_key = OPENAI_API_KEY
+GPT_MODEL = os.getenv("GPT_MODEL", "gpt-4")
+
+# Bump when the detail prompts change so cached GPT details are not reused
+GPT_PROMPT_VERSION = 2
 
 # List of Question Categories
 question_categories = [ 
@@ -31,272 +58,410 @@ question_categories = [
     "Multiple Choice Question", "Describe Questions", "Direct Question"
  ]
 
-def poll_status(pdf_id, headers, poll_interval=13, max_polls=10):
-    url = f"https://api.mathpix.com/v3/pdf/{pdf_id}.json"
-    for poll_count in range(max_polls):
-        print(f"Polling attempt {poll_count + 1} for PDF ID {pdf_id}")
-        response = requests.get(url, headers=headers)
-        status_data = response.json()
-        print("Polling Status:", status_data)
-        if status_data.get("status") == "completed":
-            return status_data
-        time.sleep(poll_interval)
+# Function to wait for a Mathpix PDF to finish converting. The shared poller
+# checks all pending PDFs from one loop with adaptive intervals; pages, if
+# known, gives large PDFs longer before Mathpix reports their page count.
+def poll_status(pdf_id, pages=None):
+    return mathpix_poller.wait(pdf_id, pages)
+
+# Conversion options sent to Mathpix; part of the cache key
+mathpix_options = {
+    "conversion_formats": {"docx": True, "tex.zip": True},
+    "math_inline_delimiters": ["$", "$"],
+    "rm_spaces": True
+}
+
+# Cleanup applied to the MMD text, in order, as it is downloaded
+mmd_replacements = [("{", ""), ("}", ""), (r"\section*", ""), (r"$\qquad$", "__")]
+
+def new_mmd_temp_path():
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".txt")
+    temp_file.close()
+    return temp_file.name
+
+# Function to delete the temp MMD files of a run, skipping conversions that failed
+def remove_mmd_files(*mmd_paths):
+    for mmd_path in mmd_paths:
+        if mmd_path and os.path.exists(mmd_path):
+            os.remove(mmd_path)
+
+# Function to copy the cached text of a PDF to a temp file; None on a miss
+def cached_mathpix_text(file, cache_key):
+    mmd_path = new_mmd_temp_path()
+    if mathpix_cache.copy_to(cache_key, mmd_path):
+        logger.info(f"Mathpix cache hit for {file.filename}")
+        metrics.increment('mathpix.cache_hits')
+        return mmd_path
+    os.remove(mmd_path)
+    metrics.increment('mathpix.cache_misses')
     return None
 
-def process_with_mathpix(file):
-    options = {
-        "conversion_formats": {"docx": True, "tex.zip": True},
-        "math_inline_delimiters": ["$", "$"],
-        "rm_spaces": True
-    }
+def process_with_mathpix(file, use_cache=True):
+    # Neither hashing nor uploading keeps the whole PDF in memory, but both need to rewind it
+    file.stream = seekable_stream(file.stream)
+    # Re-uploads of the same PDF are served from the cache without calling Mathpix
+    cache_key = mathpix_cache.key(file.stream, mathpix_options)
+    if use_cache:
+        mmd_path = cached_mathpix_text(file, cache_key)
+        if mmd_path:
+            return mmd_path
 
-    r = requests.post("https://api.mathpix.com/v3/pdf",
-        headers={
-            "app_id": MATHPIX_APP_ID,
-            "app_key": MATHPIX_API_KEY
-        },
-        data={
-            "options_json": json.dumps(options)
-        },
-        files={
-            "file": (file.filename, file.stream, file.content_type)
-        }
-    )
+    # Limit how many PDFs are with Mathpix at once across all requests and batches
+    with mathpix_slots:
+        mmd_path = convert_with_mathpix(file)
+    if mmd_path is None:
+        return None
 
-    API_resp = r.json()
+    mathpix_cache.put_file(cache_key, mmd_path)
+    return mmd_path
+
+# Function to upload a PDF to Mathpix, wait for it and write the cleaned MMD
+# text to a temp file, returning its path. upload_lock, if given, is held while
+# the file is read, for uploads of the same stream from several threads.
+def convert_with_mathpix(file, options=mathpix_options, upload_lock=None):
+    with metrics.timer('mathpix.upload'), upload_lock or contextlib.nullcontext():
+        # The whole PDF is sent each time; an earlier upload leaves the stream at its end
+        file.stream.seek(0)
+        pages = page_range_count(options['page_ranges']) if 'page_ranges' in options else count_pdf_pages(file.stream)
+        API_resp = mathpix_client.upload_pdf(file.filename, file.stream, file.content_type, options)
     pdf_id = API_resp.get("pdf_id")
     if not pdf_id:
+        logger.error(f"Mathpix upload of {file.filename} failed: {API_resp}")
         return None
 
-    headers = {
-        "app_key": MATHPIX_API_KEY,
-        "app_id": MATHPIX_APP_ID
-    }
-
-    status_data = poll_status(pdf_id, headers)
+    with metrics.timer('mathpix.polling'):
+        status_data = poll_status(pdf_id, pages)
     if not status_data:
+        logger.error(f"Mathpix conversion of {file.filename} (PDF ID {pdf_id}) did not complete")
         return None
+    metrics.increment('mathpix.pages', status_data.get('num_pages') or 0)
 
-    url = f"https://api.mathpix.com/v3/pdf/{pdf_id}.mmd"
-    response = requests.get(url, headers=headers)
-    mmd_content = response.text
+    # The MMD is cleaned and written chunk by chunk as it arrives
+    mmd_path = new_mmd_temp_path()
+    replacer = StreamingReplacer(mmd_replacements)
+    try:
+        with metrics.timer('mathpix.download'), open(mmd_path, "w", encoding="utf-8", newline="") as f:
+            for chunk in mathpix_client.stream_mmd(pdf_id):
+                f.write(replacer.feed(chunk))
+            f.write(replacer.flush())
+    except Exception:
+        os.remove(mmd_path)
+        raise
+    return mmd_path
 
-    mmd_content = mmd_content.replace("{", "").replace("}", "").replace(r"\section*", "").replace(r"$\qquad$", "__")
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".txt")
-    temp_file.write(mmd_content.encode('utf-8'))
-    temp_file.close()
+# Function to convert several files with Mathpix at the same time.
+# Each conversion spends most of its time waiting on poll_status, so running
+# them side by side makes the total latency that of the slowest file.
+def process_files_with_mathpix(*files, use_cache=True):
+    with ThreadPoolExecutor(max_workers=len(files)) as executor:
+        futures = [metrics.submit(executor, process_with_mathpix, file, use_cache) for file in files]
+    # Every conversion has finished here; if one raised, the others' text is not needed
+    error = next((future.exception() for future in futures if future.exception()), None)
+    if error:
+        remove_mmd_files(*(future.result() for future in futures if not future.exception()))
+        raise error
+    return [future.result() for future in futures]
 
-    return temp_file.name
+# Function to list the conversions of a PDF in chunks of pages_per_chunk
+# pages, using the Mathpix page_ranges option, as calls to submit in page
+# order (or a done future for cached text). PDFs that are cached, short, or
+# whose pages cannot be counted are converted in one piece. Also returns the
+# cache key to store the joined text under once every chunk is done, or None
+# if there is nothing to store.
+def paged_mathpix_chunks(file, use_cache=True, pages_per_chunk=MATHPIX_PAGES_PER_CHUNK):
+    file.stream = seekable_stream(file.stream)
+    page_count = count_pdf_pages(file.stream)
+    ranges = page_ranges(page_count, pages_per_chunk) if page_count and pages_per_chunk else []
+    if len(ranges) <= 1:
+        return [(process_with_mathpix, file, use_cache)], None
+
+    cache_key = mathpix_cache.key(file.stream, mathpix_options)
+    if use_cache:
+        mmd_path = cached_mathpix_text(file, cache_key)
+        if mmd_path:
+            cached = Future()
+            cached.set_result(mmd_path)
+            return [cached], None
+
+    # Every chunk uploads the whole PDF from the same stream, one at a time
+    upload_lock = threading.Lock()
+    def convert_pages(page_range):
+        with mathpix_slots:
+            return convert_with_mathpix(file, {**mathpix_options, 'page_ranges': page_range}, upload_lock)
+
+    logger.info(f"Converting {file.filename} in {len(ranges)} chunks of {pages_per_chunk} pages")
+    return [(convert_pages, page_range) for page_range in ranges], cache_key
+
+# Function to start converting PDFs in page chunks at the same time. The text
+# of the first chunks can be read from each returned PagedText while later
+# ones are still in OCR. Chunks are submitted in turns, the first chunk of
+# every file before the second of any, as the pipeline needs the start of
+# both the questions and the solutions before it can enrich anything.
+# Returns a (PagedText, cache key) pair per file.
+def start_paged_mathpix(files, executor, use_cache=True, pages_per_chunk=MATHPIX_PAGES_PER_CHUNK):
+    planned = [paged_mathpix_chunks(file, use_cache, pages_per_chunk) for file in files]
+    chunks = [[] for _ in files]
+    for turn in itertools.zip_longest(*(calls for calls, _ in planned)):
+        for file_chunks, call in zip(chunks, turn):
+            if call is not None:
+                file_chunks.append(call if isinstance(call, Future) else metrics.submit(executor, *call))
+    return [(PagedText(file_chunks), cache_key) for file_chunks, (_, cache_key) in zip(chunks, planned)]
+
+# Function to store the joined text of a PDF converted in chunks in the Mathpix
+# cache. A chunk the pipeline never needed may have failed; the text is then
+# not cached.
+def cache_paged_text(text, cache_key):
+    mmd_path = new_mmd_temp_path()
+    try:
+        text.join(mmd_path)
+        mathpix_cache.put_file(cache_key, mmd_path)
+    except Exception as e:
+        logger.warning(f"Chunked Mathpix text not cached: {e}")
+    finally:
+        os.remove(mmd_path)
 
 def parse_questions(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-    
-    questions = []
-    lines = content.split('\n')
-    current_question = ""
-    question_number = 1
-    
-    for line in lines:
-        if line.strip():
-            if re.match(r'^\(?\s*([0-9]+)\s*[\).]', line, re.IGNORECASE):
-                if current_question:
-                    questions.append({
-                        'text': current_question.strip(),
-                        'number': question_number
-                    })
-                    question_number += 1
-                current_question = line.strip()
-            else:
-                current_question += "\n" + line.strip()
-    
-    if current_question:
-        questions.append({
-            'text': current_question.strip(),
-            'number': question_number
-        })
-    
-    return questions
+    return list(segment_file(file_path))
 
 def parse_solutions(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-    
-    solutions = []
-    lines = content.split('\n')
-    current_solution = ""
-    solution_number = 1
-    
-    for line in lines:
-        if line.strip():
-            if re.match(r'^\(?\s*([0-9]+)\s*[\).]', line, re.IGNORECASE):
-                if current_solution:
-                    solutions.append({
-                        'text': current_solution.strip(),
-                        'number': solution_number
-                    })
-                    solution_number += 1
-                current_solution = line.strip()
-            else:
-                current_solution += "\n" + line.strip()
-    
-    if current_solution:
-        solutions.append({
-            'text': current_solution.strip(),
-            'number': solution_number
-        })
-    
-    return solutions
+    return list(segment_file(file_path))
 
-# Function to process descriptive questions
-def process_descriptive_questions(questions, solutions):
-    descriptive_data = []
-    solution_dict = {sol['number']: sol['text'] for sol in solutions}
+# Patterns used to classify questions into sheets
+OPTION_PATTERN = re.compile(r'[a-dA-D][).] [^\n]+')  # Checks for A. or a)
+SUBJECTIVE_OPTION_PATTERN = re.compile(r'[a-d][A-D]\) [^\n]+')
+BLANK_PATTERN = re.compile(r'_{2,}')
+# Marks such as "(5)" or "[2 marks]" end a line, on their own or after a space.
+# Calls like "f(3)" or "g (3)" are not marks.
+MARKS_PATTERN = re.compile(r'(?<!\S)(?<!\b[a-z]\s)[\(\[]\s*(\d+)\s*(?:marks?)?\s*[\)\]]\s*$',
+                           re.IGNORECASE | re.MULTILINE)
 
-    for question in questions:
-        solution = solution_dict.get(question['number'], '')
-        question_text = question['text'].strip()
-        question_text = question_text.replace('\n', ' ')
-        
-        if (not re.findall(r'[a-dA-D][).] [^\n]+', question_text)  # Checks for A. or a)
-            and not re.search(r'_{2,}', question_text)):
-            descriptive_data.append({
-                'Question Label': f'Q{question["number"]}',
-                'Question Category': 'Descriptive',
-                'Cognitive Skills': '',
-                'Question Source': '',
-                'Question Appears in': 'Pre/Post-Worksheet/Test',
-                'Level of Difficulty': '',
-                'Question': question_text.strip(),
-                'Marks': 1,
-                'Display Answer': solution.strip(),
-                'Answer Type': '',
-                'Answer Weightage': '',
-                'Answer Content': '',  
-                'Answer Explanation': solution.strip()  
-            })
-    
-    return descriptive_data
+# Function to detect the features of a question once: its options, whether it
+# has blanks, the marks printed in brackets at the end of a line, and the
+# sheets it goes to
+def question_features(question):
+    text = question['text']
+    options = OPTION_PATTERN.findall(text)
+    has_blanks = bool(BLANK_PATTERN.search(text))
+    marks = MARKS_PATTERN.search(text)
 
-# Function to process objective questions
-def process_objective_questions(questions, solutions):
-    objective_data = []
-    solution_dict = {sol['number']: sol['text'] for sol in solutions}
+    sheets = []
+    if len(options) == 4:
+        sheets.append('Objective')
+    subjective_text = None
+    if has_blanks:
+        subjective_text = SUBJECTIVE_OPTION_PATTERN.sub('', text).strip()
+        if BLANK_PATTERN.search(subjective_text):
+            sheets.append('Subjective')
+    elif not options and not OPTION_PATTERN.search(text.replace('\n', ' ')):
+        sheets.append('Descriptive')
 
-    for question in questions:
-        solution = solution_dict.get(question['number'], '')
-        question_text = re.sub(r'[a-dA-D][).] [^\n]+', '', question['text']).strip()
-        options = re.findall(r'[a-dA-D][).] [^\n]+', question['text'])
-
-        if len(options) == 4:
-            objective_data.append({
-                'Question Label': f'Q{question["number"]}',
-                'Question Category': '',
-                'Cognitive Skills': '',
-                'Question Source': '',
-                'Question Appears in': 'Pre/Post-Worksheet/Test',
-                'Level of Difficulty': '',
-                'Question': question_text,
-                'Marks': 1,
-                'Answer Type1': 'Words', 
-                'Answer Content1': options[0] if len(options) > 0 else '',
-                'Correct Answer1': 'No',
-                'Answer Weightage1': 0,
-                'Answer Type2': 'Words',  
-                'Answer Content2': options[1] if len(options) > 1 else '',
-                'Correct Answer2': 'No',
-                'Answer Weightage2': 0,
-                'Answer Type3': 'Words',  
-                'Answer Content3': options[2] if len(options) > 2 else '',
-                'Correct Answer3': 'No',
-                'Answer Weightage3': 0,
-                'Answer Type4': 'Words',  
-                'Answer Content4': options[3] if len(options) > 3 else '',
-                'Correct Answer4': 'No',
-                'Answer Weightage4': 0,
-                'Answer Explanation': solution
-            })
-    
-    return objective_data
+    return {
+        'options': options,
+        'has_blanks': has_blanks,
+        'marks': int(marks.group(1)) if marks else None,
+        'subjective_text': subjective_text,
+        'sheets': sheets,
+    }
 
-# Function to process subjective questions
-def process_subjective_questions(questions, solutions):
-    subjective_data = []
-    solution_dict = {sol['number']: sol['text'] for sol in solutions}
+def objective_row(question, features, solution):
+    options = features['options']
+    return {
+        'Question Label': f'Q{question["number"]}',
+        'Question Category': '',
+        'Cognitive Skills': '',
+        'Question Source': '',
+        'Question Appears in': 'Pre/Post-Worksheet/Test',
+        'Level of Difficulty': '',
+        'Question': OPTION_PATTERN.sub('', question['text']).strip(),
+        'Marks': 1,
+        'Answer Type1': 'Words', 
+        'Answer Content1': options[0],
+        'Correct Answer1': 'No',
+        'Answer Weightage1': 0,
+        'Answer Type2': 'Words',  
+        'Answer Content2': options[1],
+        'Correct Answer2': 'No',
+        'Answer Weightage2': 0,
+        'Answer Type3': 'Words',  
+        'Answer Content3': options[2],
+        'Correct Answer3': 'No',
+        'Answer Weightage3': 0,
+        'Answer Type4': 'Words',  
+        'Answer Content4': options[3],
+        'Correct Answer4': 'No',
+        'Answer Weightage4': 0,
+        'Answer Explanation': solution
+    }
+
+def subjective_row(question, features, solution):
+    return {
+        'Question Label': f'Q{question["number"]}',
+        'Question Category': 'Fill in the Blanks',
+        'Cognitive Skills': '',
+        'Question Source': '',
+        'Question Appears in': 'Pre/Post-Worksheet/Test',
+        'Level of Difficulty': '',
+        'Question': features['subjective_text'],
+        'Marks': features['marks'] or 1,
+        'Answer Type': ' ',  
+        'Answer': '',  
+        'Answer Display': 'yes',  
+        'Weightage': 1,  
+        'Placeholder': '',  
+        'answer_explanation': solution if solution else '' 
+    }
+
+def descriptive_row(question, features, solution):
+    return {
+        'Question Label': f'Q{question["number"]}',
+        'Question Category': 'Descriptive',
+        'Cognitive Skills': '',
+        'Question Source': '',
+        'Question Appears in': 'Pre/Post-Worksheet/Test',
+        'Level of Difficulty': '',
+        'Question': question['text'].strip().replace('\n', ' ').strip(),
+        'Marks': features['marks'] or 1,
+        'Display Answer': solution.strip(),
+        'Answer Type': '',
+        'Answer Weightage': '',
+        'Answer Content': '',  
+        'Answer Explanation': solution.strip()  
+    }
+
+sheet_row_builders = {
+    'Objective': objective_row,
+    'Subjective': subjective_row,
+    'Descriptive': descriptive_row,
+}
+
+# Function to sort questions into sheet rows in a single pass. Returns the rows
+# for each sheet and the questions that matched no sheet. Solutions are
+# matched through alignment, an AlignmentIndex over solutions if not given;
+# every question goes through it in order, including ones left out.
+def classify_questions(questions, solutions, alignment=None):
+    if alignment is None:
+        alignment = AlignmentIndex(solutions)
+    rows = {sheet_name: [] for sheet_name in sheet_row_builders}
+    unmatched = []
 
     for question in questions:
-        question_text = re.sub(r'[a-d][A-D]\) [^\n]+', '', question['text']).strip()
-        solution = solution_dict.get(question['number'], '')
-        
-        if re.search(r'_{2,}', question_text): 
-            subjective_data.append({
-                'Question Label': f'Q{question["number"]}',
-                'Question Category': 'Fill in the Blanks',
-                'Cognitive Skills': '',
-                'Question Source': '',
-                'Question Appears in': 'Pre/Post-Worksheet/Test',
-                'Level of Difficulty': '',
-                'Question': question_text,
-                'Marks': 1,
-                'Answer Type': ' ',  
-                'Answer': '',  
-                'Answer Display': 'yes',  
-                'Weightage': 1,  
-                'Placeholder': '',  
-                'answer_explanation': solution if solution else '' 
-            })
-    
-    return subjective_data
+        solution = alignment.match(question).text
+        features = question_features(question)
+        if not features['sheets']:
+            unmatched.append(question)
+            continue
+        for sheet_name in features['sheets']:
+            rows[sheet_name].append(sheet_row_builders[sheet_name](question, features, solution))
+
+    return rows, unmatched
+
+CORRECT_ANSWER_PATTERN = re.compile(r'[\(\s]([a-dA-D])[\).\s]', re.IGNORECASE)
 
 def extract_correct_answer(explanation):
     if not explanation or not isinstance(explanation, str):
         return None
     
-    match = re.search(r'[\(\s]([a-dA-D])[\).\s]', explanation, re.IGNORECASE)
+    match = CORRECT_ANSWER_PATTERN.search(explanation)
     if match:
         return match.group(1).lower()
     return None
 
+# Function to mark the correct option of every objective question at once.
+# The answer letter is pulled from each explanation with the same pattern as
+# extract_correct_answer; an option is correct when it starts with "<letter>)".
 def mark_correct_answers(objective_df):
-    for index, row in objective_df.iterrows():
-        correct_answer = extract_correct_answer(row['Answer Explanation'])
-        
-        for i in range(1, 5):
-            answer_content = row[f'Answer Content{i}']
-            if pd.isna(answer_content):
-                objective_df.at[index, f'Correct Answer{i}'] = 'No'
-                objective_df.at[index, f'Answer Weightage{i}'] = 0
-            elif correct_answer and answer_content.startswith(f"{correct_answer})"):
-                objective_df.at[index, f'Correct Answer{i}'] = 'Yes'
-                objective_df.at[index, f'Answer Weightage{i}'] = row['Marks'] if not pd.isna(row['Marks']) else 0
-            else:
-                objective_df.at[index, f'Correct Answer{i}'] = 'No'
-                objective_df.at[index, f'Answer Weightage{i}'] = 0
+    if objective_df.empty:
+        return objective_df
+
+    correct_answer = objective_df['Answer Explanation'].astype(object).str.extract(
+        CORRECT_ANSWER_PATTERN, expand=False
+    ).str.lower()
+    correct_prefix = correct_answer + ')'
+    marks = objective_df['Marks'].where(objective_df['Marks'].notna(), 0)
+
+    for i in range(1, 5):
+        answer_content = objective_df[f'Answer Content{i}'].astype(object)
+        is_correct = (answer_content.str[:2] == correct_prefix).fillna(False).astype(bool)
+        objective_df[f'Correct Answer{i}'] = np.where(is_correct, 'Yes', 'No')
+        objective_df[f'Answer Weightage{i}'] = marks.where(is_correct, 0)
     
     return objective_df
 
 
-# Function to process files to Excel
-def process_files_to_excel(questions_file, solutions_file, output_excel_path):
-    questions = parse_questions(questions_file)
-    solutions = parse_solutions(solutions_file)
-    
-    objective_data = process_objective_questions(questions, solutions)
-    subjective_data = process_subjective_questions(questions, solutions)
-    descriptive_data = process_descriptive_questions(questions, solutions)
+# Function to build the Objective/Subjective/Descriptive frames for a list of questions
+# Questions of later chunks can be matched with the same alignment; when it is
+# not given, one is made for solutions and its doubtful matches are reported.
+def frames_from_questions(questions, solutions, alignment=None):
+    report_alignment = alignment is None
+    if report_alignment:
+        alignment = AlignmentIndex(solutions)
+    rows, unmatched = classify_questions(questions, solutions, alignment)
+    if report_alignment:
+        alignment.report()
+    if unmatched:
+        labels = ", ".join(f'Q{question["number"]}' for question in unmatched)
+        logger.warning(f"{len(unmatched)} questions matched no sheet and were left out: {labels}")
     
-    objective_df = pd.DataFrame(objective_data)
-    subjective_df = pd.DataFrame(subjective_data)
-    descriptive_df = pd.DataFrame(descriptive_data)
+    objective_df = pd.DataFrame(rows['Objective'])
+    subjective_df = pd.DataFrame(rows['Subjective'])
+    descriptive_df = pd.DataFrame(rows['Descriptive'])
     
     objective_df = mark_correct_answers(objective_df)
-    
+
+    return {'Objective': objective_df, 'Subjective': subjective_df, 'Descriptive': descriptive_df}
+
+# Function to build the Objective/Subjective/Descriptive frames from the Mathpix text files
+def build_question_frames(questions_file, solutions_file):
+    return frames_from_questions(parse_questions(questions_file), parse_solutions(solutions_file))
+
+# Number of questions classified, enriched and written together by run_pipeline
+PIPELINE_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", "500"))
+
+# Function to split Mathpix text into segment records, from a file path or a
+# PagedText that may still be converting
+def segment_source(source):
+    return segment_file(source) if isinstance(source, str) else segment_lines(source)
+
+# Function to build the sheet frames chunk by chunk while the question file is
+# read lazily. Frame indexes continue across chunks so row numbers in logs
+# match the final sheets. Yields the number of questions and the frames.
+# Questions from a PagedText are handed on early whenever reading on would
+# wait for Mathpix, so they can be enriched in the meantime.
+def iter_question_frames(questions_file, alignment, chunk_size=PIPELINE_CHUNK_SIZE):
+    questions = segment_source(questions_file)
+    ready = questions_file.ready if isinstance(questions_file, PagedText) else None
+    offsets = {sheet_name: 0 for sheet_name in sheet_row_builders}
+    while True:
+        with metrics.timer('parsing'):
+            chunk = []
+            for question in questions:
+                chunk.append(question)
+                if len(chunk) == chunk_size or (ready and not ready()):
+                    break
+        if not chunk:
+            return
+        with metrics.timer('classification'):
+            frames = frames_from_questions(chunk, None, alignment)
+        for sheet_name, df in frames.items():
+            df.index += offsets[sheet_name]
+            offsets[sheet_name] += len(df)
+        yield len(chunk), frames
+
+def write_frames_to_excel(frames, output_excel_path):
     with pd.ExcelWriter(output_excel_path, engine='openpyxl') as writer:
-        objective_df.to_excel(writer, sheet_name='Objective', index=False)
-        subjective_df.to_excel(writer, sheet_name='Subjective', index=False)
-        descriptive_df.to_excel(writer, sheet_name='Descriptive', index=False)
-    
-    print(f"Excel file created successfully at: {output_excel_path}")
+        for sheet_name, df in frames.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+# Function to process files to Excel
+def process_files_to_excel(questions_file, solutions_file, output_excel_path):
+    write_frames_to_excel(build_question_frames(questions_file, solutions_file), output_excel_path)
+    logger.info(f"Excel file created successfully at: {output_excel_path}")
+
+# Function to add the tokens GPT reports for a reply to the metrics
+def record_gpt_usage(response):
+    usage = response.get('usage') or {}
+    metrics.increment('gpt.prompt_tokens', usage.get('prompt_tokens', 0))
+    metrics.increment('gpt.completion_tokens', usage.get('completion_tokens', 0))
 
 def get_objective_details(question_content):
     prompt = f"""
@@ -308,11 +473,12 @@ def get_objective_details(question_content):
     5. Marks: 1
     6. Answer Type: Words/Numbers/Equation/Alpha Numeric please select any one of these.
 
+    {json_reply_instructions('Objective')}
     Question Content: {question_content}
     """
     
     response = openai.ChatCompletion.create(
-        model="gpt-4",
+        model=GPT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that categorizes questions."},
             {"role": "user", "content": prompt}
@@ -321,6 +487,7 @@ def get_objective_details(question_content):
         max_tokens=150
     )
     
+    record_gpt_usage(response)
     return response.choices[0].message['content'].strip()
 
 # Function to get details for Subjective questions
@@ -333,7 +500,7 @@ def get_subjective_details(question_content):
     4. Level of Difficulty ('Less' - Remembering, Understanding (simple), 'Moderate'- Understanding (complex), Applying (simple), Creating (Simple) 'High' - Applying (complex), Analysing, Evaluating, Creating (Complex). Just give the response as 'Less', 'Moderate' or 'High' only.)
     5. Marks (1, 2, 3, 4, 5, 6... as given in the question paper within brackets)
     6. Answer Type (Words,Numbers,Equation) Please select any one of these
-    7. Answer Content: (Understanding the question and answer explanation generate a detailed marking scheme based on the answer allotted to it. 
+    7. Answer (Understanding the question and answer explanation generate a detailed marking scheme based on the answer allotted to it. 
        Break the answer into specific logical or conceptual steps/ pointers based on what is actually written in the solution. 
        Each step/ point should include a brief description and the marks awarded. The marking scheme should be context-specific, 
        not generic, and should allow for variations in variable names, wording, or approach as long as the logic is correct. Avoid verification step in the rubrics. 
@@ -342,11 +509,12 @@ def get_subjective_details(question_content):
     Question Categories:
     {", ".join(question_categories)}
 
+    {json_reply_instructions('Subjective')}
     Question Content: {question_content}
     """
     
     response = openai.ChatCompletion.create(
-        model="gpt-4",
+        model=GPT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that categorizes questions and provides additional details."},
             {"role": "user", "content": prompt}
@@ -355,6 +523,7 @@ def get_subjective_details(question_content):
         max_tokens=1500
     )
     
+    record_gpt_usage(response)
     return response.choices[0].message['content'].strip()
 
 def get_descriptive_details(question_content):
@@ -372,11 +541,12 @@ def get_descriptive_details(question_content):
        not generic, and should allow for variations in variable names, wording, or approach as long as the logic is correct. Avoid verification step in the rubrics. 
        Give the output points in a single line and not as bullet points.)
 
+    {json_reply_instructions('Descriptive')}
     Question Content: {question_content}
     """
     
     response = openai.ChatCompletion.create(
-        model="gpt-4",
+        model=GPT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that categorizes questions."},
             {"role": "user", "content": prompt}
@@ -384,141 +554,566 @@ def get_descriptive_details(question_content):
         max_tokens=300
     )
 
+    record_gpt_usage(response)
     return response.choices[0].message['content'].strip()
 
-def process_excel_file_with_gpt(input_path, output_path):
-    xls = pd.ExcelFile(input_path)
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        for sheet_name in xls.sheet_names:
-            df = xls.parse(sheet_name)
-
-            # Determine required columns based on sheet type
-            if 'Objective' in sheet_name:
-                required_columns = ['Question Category', 'Cognitive Skills', 'Question Source', 
-                                   'Level of Difficulty', 'Marks', 'Answer Type']
-            elif 'Subjective' in sheet_name:
-                required_columns = ['Question Category', 'Cognitive Skills', 'Question Source', 
-                                   'Level of Difficulty', 'Marks', 'Answer Type', 'Answer']
-            elif 'Descriptive' in sheet_name:
-                required_columns = ['Question Category', 'Cognitive Skills', 'Question Source', 
-                                   'Level of Difficulty', 'Marks', 'Answer Type', 'Answer Content']
-            else:
-                continue
+# Required GPT columns for each sheet type
+sheet_required_columns = {
+    'Objective': ['Question Category', 'Cognitive Skills', 'Question Source',
+                  'Level of Difficulty', 'Marks', 'Answer Type'],
+    'Subjective': ['Question Category', 'Cognitive Skills', 'Question Source',
+                   'Level of Difficulty', 'Marks', 'Answer Type', 'Answer'],
+    'Descriptive': ['Question Category', 'Cognitive Skills', 'Question Source',
+                    'Level of Difficulty', 'Marks', 'Answer Type', 'Answer Content'],
+}
+
+# Number of questions sent per GPT request; 1 keeps the single-question prompts
+GPT_BATCH_SIZE = int(os.getenv("GPT_BATCH_SIZE", "1"))
+
+# max_tokens used by each detail function, counted against the tokens-per-minute budget
+sheet_max_tokens = {'Objective': 150, 'Subjective': 1500, 'Descriptive': 300}
+
+# Allowed values for the constrained GPT columns, as listed in the prompts.
+# Level of Difficulty and Answer Type differ per sheet type.
+cognitive_skills = ["Remembering", "Understanding", "Applying", "Analysing", "Evaluating", "Creating"]
+common_allowed_values = {
+    'Question Category': question_categories,
+    'Cognitive Skills': cognitive_skills,
+    'Question Source': ["UpSchool DB"],
+}
+sheet_allowed_values = {
+    'Objective': {**common_allowed_values,
+                  'Level of Difficulty': ["Less", "Moderate", "Highly"],
+                  'Answer Type': ["Words", "Numbers", "Equation", "Alpha Numeric"]},
+    'Subjective': {**common_allowed_values,
+                   'Level of Difficulty': ["Less", "Moderate", "High"],
+                   'Answer Type': ["Words", "Numbers", "Equation"]},
+    'Descriptive': {**common_allowed_values,
+                    'Level of Difficulty': ["Less", "Moderate", "High"],
+                    'Answer Type': ["Equation", "Phrases"]},
+}
+
+def json_reply_instructions(sheet_type, fields=None):
+    keys = ", ".join(json.dumps(col) for col in fields or sheet_required_columns[sheet_type])
+    return f"Reply with only a JSON object using exactly these keys: {keys}.\n"
+
+def get_sheet_type(sheet_name):
+    for sheet_type in sheet_required_columns:
+        if sheet_type in sheet_name:
+            return sheet_type
+    return None
+
+# With fields, only those fields are asked for again (see get_field_details)
+def get_question_details(sheet_type, question_content, fields=None):
+    if fields:
+        return get_field_details(sheet_type, question_content, fields)
+    if sheet_type == 'Objective':
+        return get_objective_details(question_content)
+    elif sheet_type == 'Subjective':
+        return get_subjective_details(question_content)
+    elif sheet_type == 'Descriptive':
+        return get_descriptive_details(question_content)
+
+# Rough token estimate (about 4 characters per token) of prompt plus completion
+def estimate_gpt_tokens(sheet_type, question_content):
+    prompt_chars = len(question_content) + len(", ".join(question_categories)) * 2 + 1500
+    return prompt_chars // 4 + sheet_max_tokens[sheet_type]
+
+def estimate_batch_gpt_tokens(sheet_type, batch):
+    prompt_chars = sum(len(question_content) + 10 for _, question_content in batch) + len(", ".join(question_categories)) + 2000
+    return prompt_chars // 4 + min(GPT_BATCH_MAX_TOKENS, sheet_max_tokens[sheet_type] * len(batch))
+
+# Field instructions for batched and repair prompts, matching the single-question prompts
+marking_scheme_instructions = (
+    "Understanding the question and answer explanation generate a detailed marking scheme based on the answer allotted to it. "
+    "Break the answer into specific logical or conceptual steps/ pointers based on what is actually written in the solution. "
+    "Each step/ point should include a brief description and the marks awarded. The marking scheme should be context-specific, "
+    "not generic, and should allow for variations in variable names, wording, or approach as long as the logic is correct. "
+    "Avoid verification step in the rubrics. Give the points in a single line and not as bullet points."
+)
+
+difficulty_instructions = (
+    "'Less' - Remembering, Understanding (simple), 'Moderate'- Understanding (complex), Applying (simple), Creating (Simple) "
+    "'High' - Applying (complex), Analysing, Evaluating, Creating (Complex). Just give 'Less', 'Moderate' or 'High' only."
+)
+
+batch_field_instructions = {
+    'Objective': {
+        'Question Category': "select any one of the Question Categories",
+        'Cognitive Skills': "Remembering, Understanding, Applying, Analysing, Evaluating or Creating",
+        'Question Source': "UpSchool DB",
+        'Level of Difficulty': "Less/Moderate/Highly",
+        'Marks': "1",
+        'Answer Type': "Words/Numbers/Equation/Alpha Numeric please select any one of these",
+    },
+    'Subjective': {
+        'Question Category': "select any one of the Question Categories",
+        'Cognitive Skills': "Remembering, Understanding, Applying, Analysing, Evaluating or Creating, select any one of these only",
+        'Question Source': "UpSchool DB",
+        'Level of Difficulty': difficulty_instructions,
+        'Marks': "1, 2, 3, 4, 5, 6... as given in the question paper within brackets",
+        'Answer Type': "Words, Numbers or Equation, select any one of these",
+        'Answer': marking_scheme_instructions,
+    },
+    'Descriptive': {
+        'Question Category': "select any one of the Question Categories",
+        'Cognitive Skills': "Remembering, Understanding, Applying, Analysing, Evaluating or Creating, select any one of these only",
+        'Question Source': "UpSchool DB",
+        'Level of Difficulty': difficulty_instructions,
+        'Marks': "1, 2, 3, 4, 5, 6... as given in the question paper within brackets",
+        'Answer Type': "Equation or Phrases, select any one of these",
+        'Answer Content': marking_scheme_instructions,
+    },
+}
+
+# Upper bound on max_tokens for one batched request
+GPT_BATCH_MAX_TOKENS = int(os.getenv("GPT_BATCH_MAX_TOKENS", "4096"))
+
+def build_batch_prompt(sheet_type, questions):
+    fields = "\n".join(
+        f"{i}. {col}: {instructions}"
+        for i, (col, instructions) in enumerate(batch_field_instructions[sheet_type].items(), start=1)
+    )
+    keys = ", ".join(json.dumps(key) for key in ['id'] + sheet_required_columns[sheet_type])
+    numbered_questions = "\n\n".join(f"[{i}] {question}" for i, question in enumerate(questions, start=1))
+    return f"""
+    For each question below, provide the following details:
+    {fields}
+
+    Question Categories:
+    {", ".join(question_categories)}
+
+    Reply with only a JSON array containing one object per question, using exactly these keys: {keys}.
+    "id" is the number in square brackets before the question.
+
+    Questions:
+    {numbered_questions}
+    """
+
+# Function to ask again for just the fields of one question that came back
+# missing or invalid, instead of the whole set of details
+def get_field_details(sheet_type, question_content, fields):
+    instructions = "\n".join(
+        f"{i}. {col}: {batch_field_instructions[sheet_type][col]}" for i, col in enumerate(fields, start=1)
+    )
+    categories = f"Question Categories:\n    {', '.join(question_categories)}\n" if 'Question Category' in fields else ""
+    prompt = f"""
+    Based on the following question content, provide the following details:
+    {instructions}
+
+    {categories}
+    {json_reply_instructions(sheet_type, fields)}
+    Question Content: {question_content}
+    """
+
+    response = openai.ChatCompletion.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that categorizes questions and replies in JSON."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0,
+        max_tokens=sheet_max_tokens[sheet_type]
+    )
+
+    record_gpt_usage(response)
+    return response.choices[0].message['content'].strip()
+
+# Function to get details for several questions of one sheet type in a single request
+def get_batch_details(sheet_type, questions):
+    params = {}
+    if sheet_type != 'Descriptive':
+        params['temperature'] = 0
+
+    response = openai.ChatCompletion.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that categorizes questions and replies in JSON."},
+            {"role": "user", "content": build_batch_prompt(sheet_type, questions)}
+        ],
+        max_tokens=min(GPT_BATCH_MAX_TOKENS, sheet_max_tokens[sheet_type] * len(questions)),
+        **params
+    )
+
+    record_gpt_usage(response)
+    return response.choices[0].message['content'].strip()
+
+# Function to check one field against what the prompts allow. Near misses,
+# such as different case or a small typo, are mapped to the allowed value.
+# Returns None when the value is missing or cannot be repaired.
+def validate_field(sheet_type, col, value):
+    if value is None:
+        return None
+    if col == 'Marks':
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            marks = float(value)
+        else:
+            match = re.search(r'\d+(?:\.\d+)?', str(value))
+            marks = float(match.group()) if match else 0
+        return marks if marks > 0 else None
+
+    # Some replies give the marking scheme as a list of steps
+    text = " ".join(map(str, value)) if isinstance(value, list) else str(value)
+    text = text.strip().strip('"\'').strip()
+    if not text:
+        return None
+    allowed = sheet_allowed_values[sheet_type].get(col)
+    if allowed is None:
+        return text
+    lookup = {option.lower(): option for option in allowed}
+    close = difflib.get_close_matches(text.lower(), lookup, n=1, cutoff=0.8)
+    return lookup[close[0]] if close else None
+
+# Function to validate a decoded reply in one pass. Returns the values for
+# fields in order, with "" (or NA for Marks) where a field is missing or invalid.
+def validate_details(sheet_type, entry, fields):
+    details_list = []
+    for col in fields:
+        value = validate_field(sheet_type, col, entry.get(col))
+        details_list.append(value if value is not None else (pd.NA if col == 'Marks' else ""))
+    return details_list
+
+# Function to list the fields of a details list that still need a value
+def missing_fields(required_columns, details_list):
+    return [col for col, value in zip(required_columns, details_list) if pd.isna(value) or not str(value).strip()]
 
-            # Initialize missing columns
-            for col in required_columns:
-                if col not in df.columns:
-                    df[col] = pd.NA if col == 'Marks' else ""
+# Function to split a batched JSON reply back into per-row details. Rows
+# missing from the reply are left out so the caller can retry them in a
+# smaller batch; invalid fields come back empty to be asked for again.
+def parse_batch_details(details, row_indexes, sheet_type):
+    start, end = details.find('['), details.rfind(']')
+    try:
+        entries = json.loads(details[start:end + 1]) if start != -1 else []
+    except json.JSONDecodeError:
+        logger.warning("Could not decode batched GPT response")
+        return {}
 
-            # Ensure Marks column is numeric
-            if 'Marks' in df.columns:
-                df['Marks'] = pd.to_numeric(df['Marks'], errors='coerce')
-            
-            # Process each question
-            for index, row in df.iterrows():
-                question_content = str(row['Question']) if 'Question' in row else ""
+    parsed = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            position = int(entry.get('id')) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= position < len(row_indexes):
+            parsed[row_indexes[position]] = validate_details(sheet_type, entry, sheet_required_columns[sheet_type])
+    return parsed
 
-                if not question_content.strip():
-                    continue
+# Function to decode a single-question JSON reply and validate the given fields
+def parse_gpt_details(details, sheet_type, fields):
+    start, end = details.find('{'), details.rfind('}')
+    try:
+        entry = json.loads(details[start:end + 1]) if start != -1 else {}
+    except json.JSONDecodeError:
+        logger.warning("Could not decode GPT response")
+        entry = {}
+    return validate_details(sheet_type, entry if isinstance(entry, dict) else {}, fields)
 
+# Function to write parsed details back to one DataFrame row
+def apply_gpt_details(df, index, required_columns, details_list):
+    for i, col in enumerate(required_columns):
+        if i < len(details_list):
+            if col == 'Marks':
                 try:
-                    # Get GPT response
-                    if 'Objective' in sheet_name:
-                        details = get_objective_details(question_content)
-                    elif 'Subjective' in sheet_name:
-                        details = get_subjective_details(question_content)
-                    elif 'Descriptive' in sheet_name:
-                        details = get_descriptive_details(question_content)
-                    
-                    print(f"\nGPT Response for question {index + 1}:\n{details}")
-                    
-                    # Parse the response
-                    parsed_data = {}
-                    answer_content = []
-                    in_answer_content = False
-                    for line in details.split('\n'):
-                        line = line.strip()
-                        # Skip empty lines
-                        if not line:
-                            continue
-                        # Detect Answer Content section with multiple possible headers
-                        if (re.match(r'^(\d+\.\s*)?(Answer Content|Answer):', line, re.IGNORECASE) or
-                            'solution will involve' in line.lower()):
-                            in_answer_content = True
-                            # Remove header part
-                            line = re.sub(r'^(\d+\.\s*)?(Answer Content|Answer):\s*', '', line, flags=re.IGNORECASE).strip()
-                            if line:
-                                answer_content.append(line)
-                            continue
-
-                        if in_answer_content:
-                            # Clean and keep answer content lines
-                            clean_line = re.sub(r'^[\s\-•*]+', '', line)  # Remove leading bullets/dashes
-                            if clean_line:
-                                answer_content.append(clean_line)
-                        else:
-                            # Parse key-value pairs
-                            if ': ' in line:
-                                # Remove numbering prefix if present
-                                line = re.sub(r'^\d+\.\s*', '', line)
-                                key, value = line.split(': ', 1)
-                                parsed_data[key.strip()] = value.strip()
-                    
-                    # Debug prints
-                    print("Parsed Data:", parsed_data)
-                    print("Answer Content:", answer_content)
-                    
-                    # Map to required columns
-                    column_mapping = {
-                        'Question Category': ['Question Category'],
-                        'Cognitive Skills': ['Cognitive Skills'],
-                        'Question Source': ['Question Source'],
-                        'Level of Difficulty': ['Level of Difficulty'],
-                        'Marks': ['Marks'],
-                        'Answer Type': ['Answer Type'],
-                        #'answer_type': ['Answer Type']  #  for subjective sheets
-                    }
-                    
-                    details_list = []
-                    for col in required_columns:
-                        found = False
-                        # Check all possible keys for this column
-                        for key in column_mapping.get(col, [col]):
-                            if key in parsed_data:
-                                details_list.append(parsed_data[key])
-                                found = True
-                                break
-                        
-                        if not found and col in ['Answer Content', 'Answer']:
-                            details_list.append('\n'.join(answer_content) if answer_content else "")
-                        elif not found:
-                            details_list.append(pd.NA if col == 'Marks' else "")
-                    
-                    print(f"Final Parsed Details: {details_list}")
-
-                    # Update DataFrame
-                    for i, col in enumerate(required_columns):
-                        if i < len(details_list):
-                            if col == 'Marks':
-                                try:
-                                    # Extract first number from marks field
-                                    marks_value = re.search(r'\d+', str(details_list[i]))
-                                    df.at[index, col] = float(marks_value.group()) if marks_value else pd.NA
-                                except (ValueError, TypeError):
-                                    df.at[index, col] = pd.NA
-                            else:
-                                # Store the full value, removing any surrounding quotes
-                                value = str(details_list[i]).strip('"\'')
-                                df.at[index, col] = value
-                    
-                except Exception as e:
-                    print(f"Error processing question {index + 1}: {str(e)}")
-                    continue
-
-            # Save the sheet
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-    
-    print(f"\nSuccessfully processed and saved to {output_path}")
+                    # Extract first number from marks field
+                    marks_value = re.search(r'\d+', str(details_list[i]))
+                    df.at[index, col] = float(marks_value.group()) if marks_value else pd.NA
+                except (ValueError, TypeError):
+                    df.at[index, col] = pd.NA
+            else:
+                # Store the full value, removing any surrounding quotes
+                value = str(details_list[i]).strip('"\'')
+                df.at[index, col] = value
+
+# Function to fill the GPT columns of one sheet. Questions already in the GPT
+# cache are filled straight away. The rest are sent to GPT on a bounded
+# worker pool under shared rate limits, and results are written back by
+# row index on this thread once they finish.
+#
+# With batch_size > 1 questions are sent in groups through get_batch_details.
+# Rows that a batch fails to return are retried in batches of half the size,
+# down to the single-question prompts. Every reply is validated against the
+# allowed values, and fields that fail are asked for again on their own.
+#
+# With a checkpoint journal every row is recorded as soon as its answer
+# arrives, and rows already in the journal are not sent again. Rows that
+# errored or came back with empty fields are only re-sent with retry_failed.
+def enrich_sheet_with_gpt(df, sheet_type, max_workers=GPT_MAX_WORKERS, limiter=None, batch_size=GPT_BATCH_SIZE,
+                          journal=None, sheet_name=None, retry_failed=False):
+    required_columns = sheet_required_columns[sheet_type]
+    limiter = limiter or default_limiter
+    sheet_name = sheet_name or sheet_type
+
+    # Initialize missing columns. Text columns read back empty from Excel come
+    # in as float NaN, so make them object columns before writing strings.
+    for col in required_columns:
+        if col not in df.columns:
+            df[col] = pd.NA if col == 'Marks' else ""
+        elif col != 'Marks':
+            df[col] = df[col].astype(object)
+
+    # Ensure Marks column is numeric
+    if 'Marks' in df.columns:
+        df['Marks'] = pd.to_numeric(df['Marks'], errors='coerce')
+
+    # Collect the questions to send
+    items = []
+    for index, row in df.iterrows():
+        question_content = str(row['Question']) if 'Question' in row else ""
+        if question_content.strip():
+            items.append((index, question_content))
+
+    questions = dict(items)
+    results = {}
+
+    # Pick up rows finished before a restart
+    if journal:
+        remaining = []
+        for index, question_content in items:
+            entry = journal.get(sheet_name, index, question_content)
+            if entry is None or (retry_failed and journal.is_failed(entry)):
+                remaining.append((index, question_content))
+            elif entry['details']:
+                results[index] = [pd.NA if value is None else value for value in entry['details']]
+        if len(remaining) < len(items):
+            logger.info(f"Checkpoint: {len(items) - len(remaining)} of {len(items)} {sheet_type} questions already done")
+            metrics.increment('gpt.checkpoint_hits', len(items) - len(remaining))
+        items = remaining
+
+    def checkpoint(index, details_list=None, error=None):
+        if journal:
+            if details_list is not None:
+                details_list = [None if pd.isna(value) else value for value in details_list]
+            journal.record(sheet_name, index, questions[index], details_list, error)
+
+    # Serve questions seen before from the cache
+    cache_keys = {}
+    pending = []
+    for index, question_content in items:
+        cache_keys[index] = gpt_cache.key(sheet_type, GPT_PROMPT_VERSION, GPT_MODEL, question_content)
+        cached = gpt_cache.get(cache_keys[index])
+        if cached is not None:
+            results[index] = [pd.NA if value is None else value for value in cached]
+        else:
+            pending.append((index, question_content))
+    cached_indexes = set(results)
+    if len(pending) < len(items):
+        logger.info(f"GPT cache hits: {len(items) - len(pending)} of {len(items)} {sheet_type} questions")
+    metrics.increment('gpt.cache_hits', len(items) - len(pending))
+
+    def fetch_batch(batch):
+        details = get_batch_details(sheet_type, [question_content for _, question_content in batch])
+        logger.debug(f"GPT response for questions {[index + 1 for index, _ in batch]}:\n{details}")
+        return parse_batch_details(details, [index for index, _ in batch], sheet_type)
+
+    def fetch_single(question_content):
+        details = get_question_details(sheet_type, question_content)
+        logger.debug(f"GPT response:\n{details}")
+        return parse_gpt_details(details, sheet_type, required_columns)
+
+    while batch_size > 1 and pending:
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        batch_results, batch_errors = enrich_rows(
+            [(batch[0][0], batch) for batch in batches],
+            fetch_batch,
+            max_workers=max_workers,
+            limiter=limiter,
+            estimate_tokens=lambda batch: estimate_batch_gpt_tokens(sheet_type, batch),
+            on_done=lambda key, parsed, error: [checkpoint(index, details_list)
+                                                for index, details_list in (parsed or {}).items()]
+        )
+        for index, e in batch_errors.items():
+            logger.warning(f"Error processing batch starting at question {index + 1}: {str(e)}")
+        for parsed in batch_results.values():
+            results.update(parsed)
+        pending = [item for item in pending if item[0] not in results]
+        if pending:
+            logger.info(f"{len(pending)} questions missing from batched responses, retrying with smaller batches")
+        batch_size //= 2
+
+    single_results, errors = enrich_rows(
+        pending,
+        fetch_single,
+        max_workers=max_workers,
+        limiter=limiter,
+        estimate_tokens=lambda question_content: estimate_gpt_tokens(sheet_type, question_content),
+        on_done=checkpoint
+    )
+    results.update(single_results)
+
+    # Ask again for just the fields that came back missing or invalid
+    repairs = []
+    for index, details_list in results.items():
+        fields = missing_fields(required_columns, details_list)
+        if fields and index not in cached_indexes:
+            repairs.append((index, (questions[index], fields)))
+    if repairs:
+        repaired_fields = sum(len(fields) for _, (_, fields) in repairs)
+        logger.info(f"Re-requesting {repaired_fields} invalid fields for {len(repairs)} {sheet_type} questions")
+        metrics.increment('gpt.field_repairs', repaired_fields)
+
+    def fetch_fields(item):
+        question_content, fields = item
+        details = get_question_details(sheet_type, question_content, fields)
+        logger.debug(f"GPT response for fields {fields}:\n{details}")
+        return dict(zip(fields, parse_gpt_details(details, sheet_type, fields)))
+
+    def merge_fields(index, values, error):
+        if values:
+            results[index] = [
+                values[col] if col in values and not missing_fields([col], [values[col]]) else value
+                for col, value in zip(required_columns, results[index])
+            ]
+            checkpoint(index, results[index])
+
+    _, repair_errors = enrich_rows(
+        repairs,
+        fetch_fields,
+        max_workers=max_workers,
+        limiter=limiter,
+        estimate_tokens=lambda item: estimate_gpt_tokens(sheet_type, item[0]),
+        on_done=merge_fields
+    )
+    for index, e in repair_errors.items():
+        logger.warning(f"Error re-requesting fields for question {index + 1}: {str(e)}")
+
+    for index, details_list in results.items():
+        try:
+            logger.debug(f"Final parsed details for question {index + 1}: {details_list}")
+            apply_gpt_details(df, index, required_columns, details_list)
+        except Exception as e:
+            errors[index] = e
+            continue
+        # Only remember complete answers so a bad response is asked again next time
+        if index not in cached_indexes and not missing_fields(required_columns, details_list):
+            gpt_cache.put(cache_keys[index], details_list)
+
+    for index, e in sorted(errors.items()):
+        logger.error(f"Error processing question {index + 1}: {str(e)}")
+
+    return df
+
+# Function to fill the GPT columns of every known sheet. Sheets with an
+# unknown name are dropped, as they always were from the final workbook.
+# progress, if given, is called with the sheet name and the fraction of sheets done.
+def enrich_frames_with_gpt(frames, max_workers=GPT_MAX_WORKERS, batch_size=GPT_BATCH_SIZE, progress=None, limiter=None,
+                           journal=None, retry_failed=False):
+    limiter = limiter or default_limiter
+    enriched = {}
+    for sheet_number, (sheet_name, df) in enumerate(frames.items()):
+        if progress:
+            progress(sheet_name, sheet_number / len(frames))
+
+        # Determine sheet type from the sheet name
+        sheet_type = get_sheet_type(sheet_name)
+        if not sheet_type:
+            continue
+
+        enriched[sheet_name] = enrich_sheet_with_gpt(df, sheet_type, max_workers=max_workers, limiter=limiter,
+                                                     batch_size=batch_size, journal=journal, sheet_name=sheet_name,
+                                                     retry_failed=retry_failed)
+    return enriched
+
+# checkpoint_path, if given, is the journal that lets a rerun skip finished
+# rows; pass retry_failed=True to re-send only the rows that failed.
+def process_excel_file_with_gpt(input_path, output_path, max_workers=GPT_MAX_WORKERS, batch_size=GPT_BATCH_SIZE,
+                                progress=None, checkpoint_path=None, retry_failed=False):
+    frames = pd.read_excel(input_path, sheet_name=None)
+    journal = CheckpointJournal(checkpoint_path) if checkpoint_path else None
+    try:
+        frames = enrich_frames_with_gpt(frames, max_workers=max_workers, batch_size=batch_size, progress=progress,
+                                        journal=journal, retry_failed=retry_failed)
+    finally:
+        if journal:
+            journal.close()
+    write_frames_to_excel(frames, output_path)
+    report_failed_rows(journal)
+
+    logger.info(f"Successfully processed and saved to {output_path}")
+
+def report_failed_rows(journal):
+    failed_rows = journal.failed_rows() if journal else []
+    if failed_rows:
+        logger.warning(f"{len(failed_rows)} questions failed or came back incomplete; retry them with retry_failed: "
+                       + ", ".join(f"{sheet} {row + 1}" for sheet, row in failed_rows))
+
+# Keep the pre-GPT workbook next to the final one, for debugging
+KEEP_INTERMEDIATE_EXCEL = os.getenv("KEEP_INTERMEDIATE_EXCEL", "0") == "1"
+
+# Function to turn the Mathpix text files into the final workbook. Questions
+# are read, classified, enriched and streamed into the workbook in chunks of
+# chunk_size, so memory does not grow with the size of the paper. The
+# intermediate workbook is only written when intermediate_excel_path is given.
+# progress, if given, is called with the fraction of questions done.
+# checkpoint_path and retry_failed work as in process_excel_file_with_gpt.
+# The text files may also be PagedTexts still being converted; progress then
+# counts the question page chunks read. Low-confidence matches of questions to
+# solutions are added to the job's metrics as review entries naming paper.
+def run_pipeline(questions_file, solutions_file, output_excel_path, intermediate_excel_path=None, progress=None,
+                 chunk_size=PIPELINE_CHUNK_SIZE, checkpoint_path=None, retry_failed=False, paper=None):
+    # Solutions are read only as far as the questions matched so far need
+    alignment = AlignmentIndex(segment_source(solutions_file))
+    if isinstance(questions_file, PagedText):
+        total_questions = None
+    else:
+        with metrics.timer('parsing'):
+            total_questions = sum(1 for _ in segment_file(questions_file))
+
+    writer = StreamingExcelWriter(output_excel_path, sheet_row_builders)
+    intermediate_writer = StreamingExcelWriter(intermediate_excel_path, sheet_row_builders) if intermediate_excel_path else None
+
+    journal = CheckpointJournal(checkpoint_path) if checkpoint_path else None
+
+    done = 0
+    try:
+        for question_count, frames in iter_question_frames(questions_file, alignment, chunk_size):
+            for sheet_name, df in frames.items():
+                metrics.increment(f'questions.{sheet_name}', len(df))
+            if intermediate_writer:
+                with metrics.timer('excel.write'):
+                    intermediate_writer.write_frames(frames)
+            with metrics.timer('gpt.enrichment'):
+                enriched = enrich_frames_with_gpt(frames, journal=journal, retry_failed=retry_failed)
+            with metrics.timer('excel.write'):
+                writer.write_frames(enriched)
+            done += question_count
+            if progress:
+                progress(done / max(1, total_questions) if total_questions is not None else questions_file.fraction_read())
+    finally:
+        if journal:
+            journal.close()
+    report_failed_rows(journal)
+    alignment.report(paper)
+
+    with metrics.timer('excel.write'):
+        if intermediate_writer:
+            intermediate_writer.close()
+        # Sheets without questions keep the GPT columns as their header, as before
+        writer.close(empty_sheet_columns=sheet_required_columns)
+    if intermediate_writer:
+        logger.info(f"Intermediate Excel file written to: {intermediate_excel_path}")
+    logger.info(f"Successfully processed and saved to {output_excel_path}")
+
+# Function to convert a question paper and its answer sheet in page chunks and
+# run the pipeline on their text as it arrives, so parsing and GPT overlap
+# with OCR. Takes the run_pipeline options; raises MathpixError if a chunk
+# could not be converted.
+def run_pipelined(question_paper, answer_sheet, output_excel_path, use_cache=True, **pipeline_options):
+    pipeline_options.setdefault('paper', question_paper.filename)
+    executor = ThreadPoolExecutor(max_workers=MATHPIX_MAX_CONCURRENT)
+    started = []
+    try:
+        started = start_paged_mathpix([question_paper, answer_sheet], executor, use_cache)
+        run_pipeline(started[0][0], started[1][0], output_excel_path, **pipeline_options)
+        for text, cache_key in started:
+            if cache_key:
+                cache_paged_text(text, cache_key)
+    finally:
+        # Chunks not started yet are not needed after a failure
+        executor.shutdown(cancel_futures=True)
+        for text, _ in started:
+            text.remove()
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -531,35 +1126,257 @@ def upload_file():
     if question_paper.filename == '' or answer_sheet.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    print("Processing files with Mathpix...")
-    question_txt_path = process_with_mathpix(question_paper)
-    answer_txt_path = process_with_mathpix(answer_sheet)
+    with metrics.collect() as request_metrics:
+        logger.info("Processing files with Mathpix...")
+        # Send bypassCache=true to force a fresh Mathpix conversion
+        use_cache = request.form.get('bypassCache', '').lower() not in ('1', 'true', 'yes')
+        # Each request writes its own workbook, as several can run at once
+        output_dir = tempfile.mkdtemp(prefix="upload-")
+        final_excel_path = os.path.join(output_dir, "final_output.xlsx")
+        intermediate_excel_path = "intermediate_output.xlsx" if KEEP_INTERMEDIATE_EXCEL else None
 
-    if not question_txt_path or not answer_txt_path:
-        return jsonify({'error': 'Failed to process files with Mathpix'}), 500
+        try:
+            if MATHPIX_PAGES_PER_CHUNK:
+                try:
+                    run_pipelined(question_paper, answer_sheet, final_excel_path, use_cache,
+                                  intermediate_excel_path=intermediate_excel_path)
+                except MathpixError:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                    return jsonify({'error': 'Failed to process files with Mathpix'}), 500
+            else:
+                question_txt_path, answer_txt_path = process_files_with_mathpix(question_paper, answer_sheet, use_cache=use_cache)
+                try:
+                    if not question_txt_path or not answer_txt_path:
+                        shutil.rmtree(output_dir, ignore_errors=True)
+                        return jsonify({'error': 'Failed to process files with Mathpix'}), 500
 
-    print("Generating intermediate Excel file...")
-    intermediate_excel_path = "intermediate_output.xlsx"
-    process_files_to_excel(question_txt_path, answer_txt_path, intermediate_excel_path)
+                    logger.info("Processing questions with GPT...")
+                    run_pipeline(question_txt_path, answer_txt_path, final_excel_path, intermediate_excel_path,
+                                 paper=question_paper.filename)
+                finally:
+                    remove_mmd_files(question_txt_path, answer_txt_path)
+        except Exception:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            raise
+    logger.info(f"Upload timings:\n{request_metrics.summary()}")
 
-    print("Processing Excel file with GPT...")
-    final_excel_path = "final_output.xlsx"
-    process_excel_file_with_gpt(intermediate_excel_path, final_excel_path)
+   # Return the final Excel file to the user
+    logger.info("Sending final Excel file to the user...")
+    response = send_file(
+        final_excel_path,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name='final_output.xlsx'
+    )
+    response.call_on_close(lambda: shutil.rmtree(output_dir, ignore_errors=True))
+    return response
+# Function to turn a question paper PDF and its answer sheet PDF on disk into
+# the final workbook. progress, if given, is called with a stage and a percent.
+def process_pdf_pair(question_paper_path, question_paper_name, answer_sheet_path, answer_sheet_name,
+                     output_excel_path, use_cache=True, intermediate_excel_path=None, progress=None,
+                     checkpoint_path=None, retry_failed=False):
+    progress = progress or (lambda stage, percent: None)
 
-    print("Sending final Excel file to the user...")
+    progress('mathpix', 5)
+    with open(question_paper_path, 'rb') as question_stream, open(answer_sheet_path, 'rb') as answer_stream:
+        question_paper = FileStorage(question_stream, question_paper_name, content_type='application/pdf')
+        answer_sheet = FileStorage(answer_stream, answer_sheet_name, content_type='application/pdf')
+        if MATHPIX_PAGES_PER_CHUNK:
+            run_pipelined(
+                question_paper, answer_sheet, output_excel_path, use_cache,
+                intermediate_excel_path=intermediate_excel_path,
+                progress=lambda fraction: progress('gpt', 5 + 90 * fraction),
+                checkpoint_path=checkpoint_path, retry_failed=retry_failed
+            )
+            return output_excel_path
+        question_txt_path, answer_txt_path = process_files_with_mathpix(question_paper, answer_sheet, use_cache=use_cache)
+    try:
+        if not question_txt_path or not answer_txt_path:
+            raise RuntimeError('Failed to process files with Mathpix')
 
-   # Return the final Excel file to the user
-    print("Sending final Excel file to the user...")
+        progress('parsing', 40)
+        run_pipeline(
+            question_txt_path, answer_txt_path, output_excel_path, intermediate_excel_path,
+            progress=lambda fraction: progress('gpt', 45 + 50 * fraction),
+            checkpoint_path=checkpoint_path, retry_failed=retry_failed, paper=question_paper_name
+        )
+    finally:
+        remove_mmd_files(question_txt_path, answer_txt_path)
+    return output_excel_path
+
+# Function to run the whole pipeline for a queued job. The uploaded files were
+# saved into the job directory by create_job. GPT results are checkpointed in
+# the job directory, so a job picked up again after a restart carries on.
+def run_upload_job(job, progress):
+    params = job['params']
+    job_dir = job_store.job_dir(job['id'])
+    intermediate_excel_path = os.path.join(job_dir, 'intermediate_output.xlsx') if KEEP_INTERMEDIATE_EXCEL else None
+    return process_pdf_pair(
+        params['question_paper_path'], params['question_paper_name'],
+        params['answer_sheet_path'], params['answer_sheet_name'],
+        os.path.join(job_dir, 'final_output.xlsx'),
+        use_cache=params['use_cache'],
+        intermediate_excel_path=intermediate_excel_path,
+        progress=progress,
+        checkpoint_path=os.path.join(job_dir, 'gpt_checkpoint.jsonl'),
+        retry_failed=params.get('retry_failed', False)
+    )
+
+# Function to run a ZIP of paper/answer pairs uploaded to /batch
+def run_batch_job(job, progress):
+    # Imported here because batch.py builds on this module
+    from batch import run_batch_archive
+    params = job['params']
+    return run_batch_archive(params['archive_path'], job_store.job_dir(job['id']), merged=params['merged'],
+                             use_cache=params['use_cache'], progress=progress,
+                             retry_failed=params.get('retry_failed', False))
+
+job_handlers = {
+    'upload': run_upload_job,
+    'batch': run_batch_job,
+}
+
+def run_job(job, progress):
+    return job_handlers[job['params'].get('type', 'upload')](job, progress)
+
+job_store = JobStore()
+job_runner = JobRunner(job_store, run_job)
+
+def job_status(job):
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'percent': job['percent'],
+        'error': job['error'],
+        'metrics': json.loads(job['metrics']) if job.get('metrics') else None,
+        'status_url': url_for('get_job', job_id=job['id']),
+        'download_url': url_for('download_job', job_id=job['id']),
+    }
+
+# Asynchronous version of /upload: saves the files, queues a job and returns its ID
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    if 'questionPaper' not in request.files or 'answerSheet' not in request.files:
+        return jsonify({'error': 'Missing files'}), 400
+
+    question_paper = request.files['questionPaper']
+    answer_sheet = request.files['answerSheet']
+
+    if question_paper.filename == '' or answer_sheet.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    job_id = job_store.new_job_id()
+    job_dir = job_store.job_dir(job_id)
+    params = {
+        'type': 'upload',
+        'question_paper_name': question_paper.filename,
+        'question_paper_path': os.path.join(job_dir, 'question_paper.pdf'),
+        'answer_sheet_name': answer_sheet.filename,
+        'answer_sheet_path': os.path.join(job_dir, 'answer_sheet.pdf'),
+        'use_cache': request.form.get('bypassCache', '').lower() not in ('1', 'true', 'yes'),
+    }
+    question_paper.save(params['question_paper_path'])
+    answer_sheet.save(params['answer_sheet_path'])
+
+    try:
+        job_runner.submit(job_id, params)
+    except QueueFull:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({'error': 'Too many jobs waiting, try again later'}), 503
+
+    return jsonify(job_status(job_store.get(job_id))), 202
+
+# Bulk version of /jobs: a ZIP of question paper/answer sheet pairs, run as one job.
+# The result is a ZIP with one workbook per pair, or one merged workbook with merged=true.
+@app.route('/batch', methods=['POST'])
+def create_batch_job():
+    archive = request.files.get('archive')
+    if not archive or archive.filename == '':
+        return jsonify({'error': 'Missing archive'}), 400
+    if not archive.filename.lower().endswith('.zip'):
+        return jsonify({'error': 'Archive must be a ZIP file'}), 400
+
+    job_id = job_store.new_job_id()
+    job_dir = job_store.job_dir(job_id)
+    params = {
+        'type': 'batch',
+        'archive_path': os.path.join(job_dir, 'input.zip'),
+        'merged': request.form.get('merged', '').lower() in ('1', 'true', 'yes'),
+        'use_cache': request.form.get('bypassCache', '').lower() not in ('1', 'true', 'yes'),
+    }
+    archive.save(params['archive_path'])
+
+    # Imported here because batch.py builds on this module
+    from batch import ArchiveTooLarge, check_archive
+    try:
+        check_archive(params['archive_path'])
+    except (ArchiveTooLarge, zipfile.BadZipFile) as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({'error': str(e) if isinstance(e, ArchiveTooLarge) else 'Archive is not a valid ZIP file'}), 400
+
+    try:
+        job_runner.submit(job_id, params)
+    except QueueFull:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({'error': 'Too many jobs waiting, try again later'}), 503
+
+    return jsonify(job_status(job_store.get(job_id))), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+# Run a finished job again, re-sending to GPT only the questions that errored
+# or came back with empty fields. Everything else comes from the checkpoint.
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] not in ('completed', 'failed'):
+        return jsonify(job_status(job)), 409
+
+    params = json.loads(job['params'])
+    params['retry_failed'] = True
+    # Conversions are cached even with bypassCache, so a retry never pays Mathpix again
+    params['use_cache'] = True
+    job_runner.resubmit(job_id, params)
+    return jsonify(job_status(job_store.get(job_id))), 202
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def download_job(job_id):
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'completed':
+        return jsonify(job_status(job)), 409
+    if job['result_path'].endswith('.zip'):
+        return send_file(job['result_path'], mimetype='application/zip', as_attachment=True,
+                         download_name='final_outputs.zip')
     return send_file(
-        final_excel_path,
+        job['result_path'],
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         as_attachment=True,
         download_name='final_output.xlsx'
     )
+
+# Stage timers and counters for everything this process has run
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    snapshot = metrics.registry.snapshot()
+    snapshot['uptime_seconds'] = round(time.time() - metrics.registry.started_at, 1)
+    snapshot['caches'] = {'mathpix': mathpix_cache.stats(), 'gpt': gpt_cache.stats()}
+    return jsonify(snapshot)
+
 @app.route("/", methods=["GET"])
 def home():
     return " Backend is up and working!"
 
+# Development server only; run gunicorn -c gunicorn.conf.py wsgi:app in production
 if __name__ == '__main__':
     app.run(debug=True, port=5000, host='0.0.0.0')
 
@@ -0,0 +1,256 @@
+"""Bulk conversion of question paper / answer sheet pairs.
+
+Files are paired by name: the stem with its role words removed must match,
+e.g. "maths_unit1_question_paper.pdf" and "maths_unit1_answer_key.pdf".
+With one folder per pair, e.g. "unit1/question_paper.pdf" and
+"unit1/answer_key.pdf", the folder names the pair.
+
+    python batch.py papers/ --output out/
+    python batch.py papers.zip --output out/ --merged
+"""
+import argparse
+import logging
+import os
+import re
+import shutil
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import metrics
+from app import process_pdf_pair, sheet_required_columns, sheet_row_builders
+from excel_writer import StreamingExcelWriter
+
+logger = logging.getLogger(__name__)
+
+# Number of pairs processed at once. Mathpix and GPT calls are further capped
+# process-wide by MATHPIX_MAX_CONCURRENT and GPT_MAX_CONCURRENT.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+# Archives that would unpack to more than this many bytes or files are
+# rejected before anything is extracted
+BATCH_MAX_UNCOMPRESSED_BYTES = int(os.getenv("BATCH_MAX_UNCOMPRESSED_BYTES", str(2 * 1024 ** 3)))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "1000"))
+
+QUESTION_WORDS = {'question', 'questions', 'qp', 'questionpaper'}
+ANSWER_WORDS = {'answer', 'answers', 'ans', 'solution', 'solutions', 'key', 'answerkey', 'answersheet',
+                'ms', 'marking', 'scheme'}
+# Words that give the role only when no word above does, so
+# "physics_paper_2_answers" is an answer and "question_sheet" a question
+WEAK_ROLE_WORDS = {'paper': 'question', 'sheet': 'answer'}
+NAME_SEPARATORS = re.compile(r'[\s_\-.]+')
+PATH_SEPARATORS = re.compile(r'[\s_\-./\\]+')
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+# Split a file name into the shared pair name and its role ('question' or 'answer')
+def pair_name(path):
+    words = [word for word in NAME_SEPARATORS.split(os.path.splitext(os.path.basename(path))[0].lower()) if word]
+    is_question = any(word in QUESTION_WORDS for word in words)
+    is_answer = any(word in ANSWER_WORDS for word in words)
+    if not is_question and not is_answer:
+        roles = {WEAK_ROLE_WORDS[word] for word in words if word in WEAK_ROLE_WORDS}
+        is_question, is_answer = 'question' in roles, 'answer' in roles
+    if is_question == is_answer:
+        return None, None
+    name = "_".join(word for word in words if word not in QUESTION_WORDS | ANSWER_WORDS | WEAK_ROLE_WORDS.keys())
+    return name, 'question' if is_question else 'answer'
+
+
+# Function to pair question papers with answer sheets. Returns the pairs,
+# sorted by name, and the files that could not be paired. Names that are
+# empty or found in several folders, as with one folder per pair, are
+# prefixed with the folder relative to root. Pairs still without a name
+# would have no output file name, so their files are left unpaired.
+def pair_files(paths, root=None):
+    named = [(path, *pair_name(path)) for path in sorted(paths)]
+    counts = {}
+    for path, name, role in named:
+        counts[name, role] = counts.get((name, role), 0) + 1
+
+    found = {}
+    unpaired = []
+    for path, name, role in named:
+        if name is not None and (not name or counts[name, role] > 1):
+            folder = os.path.dirname(path)
+            folder = os.path.relpath(folder, root) if root and folder else folder
+            name = "_".join(word for word in PATH_SEPARATORS.split(folder.lower()) + [name] if word)
+        if not name or role in found.setdefault(name, {}):
+            unpaired.append(path)
+            continue
+        found[name][role] = path
+
+    pairs = []
+    for name, roles in sorted(found.items()):
+        if 'question' in roles and 'answer' in roles:
+            pairs.append({'name': name, 'question': roles['question'], 'answer': roles['answer']})
+        else:
+            unpaired.extend(roles.values())
+    return pairs, unpaired
+
+
+# Function to check an archive's listed sizes against the limits. zipfile
+# never extracts more than a member's listed size, so the sum bounds the
+# disk used. Raises ArchiveTooLarge, or zipfile.BadZipFile if it is not a ZIP.
+def check_archive(archive_path, max_bytes=BATCH_MAX_UNCOMPRESSED_BYTES, max_files=BATCH_MAX_FILES):
+    with zipfile.ZipFile(archive_path) as archive:
+        members = archive.infolist()
+    if len(members) > max_files:
+        raise ArchiveTooLarge(f"Archive has {len(members)} files, more than the limit of {max_files}")
+    size = sum(member.file_size for member in members)
+    if size > max_bytes:
+        raise ArchiveTooLarge(f"Archive unpacks to {size} bytes, more than the limit of {max_bytes}")
+
+
+def extract_archive(archive_path, directory):
+    check_archive(archive_path)
+    with zipfile.ZipFile(archive_path) as archive:
+        archive.extractall(directory)
+
+
+def find_pdfs(directory):
+    pdfs = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('__MACOSX')]
+        pdfs.extend(os.path.join(root, f) for f in files if f.lower().endswith('.pdf') and not f.startswith('._'))
+    return pdfs
+
+
+# Function to combine the per-pair workbooks into one, with a Paper column
+# saying which pair each row came from
+def merge_workbooks(outputs, output_path):
+    writer = StreamingExcelWriter(output_path, sheet_row_builders)
+    for name, path in outputs:
+        for sheet_name, df in pd.read_excel(path, sheet_name=None).items():
+            if sheet_name in writer.sheets:
+                df.insert(0, 'Paper', name)
+                writer.write_frame(sheet_name, df)
+    writer.close(empty_sheet_columns={
+        sheet_name: ['Paper'] + columns for sheet_name, columns in sheet_required_columns.items()
+    })
+
+
+# Function to run every pair through the pipeline on a shared worker pool and
+# write one workbook per pair into output_dir (plus a merged one if asked).
+# GPT results are checkpointed per pair in checkpoint_dir, if given, so a
+# rerun only sends what is missing (or what failed, with retry_failed).
+def run_batch(pairs, output_dir, merged=False, use_cache=True, workers=BATCH_WORKERS, progress=None,
+              checkpoint_dir=None, retry_failed=False):
+    if not all(pair['name'] for pair in pairs):
+        raise ValueError('Every pair needs a name for its output file')
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.monotonic()
+    outputs = {}
+    failed = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            metrics.submit(
+                executor,
+                process_pdf_pair,
+                pair['question'], os.path.basename(pair['question']),
+                pair['answer'], os.path.basename(pair['answer']),
+                os.path.join(output_dir, f"{pair['name']}.xlsx"),
+                use_cache=use_cache,
+                checkpoint_path=os.path.join(checkpoint_dir, f"{pair['name']}.jsonl") if checkpoint_dir else None,
+                retry_failed=retry_failed
+            ): pair['name']
+            for pair in pairs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                outputs[name] = future.result()
+                logger.info(f"[{done}/{len(pairs)}] {name}: done")
+            except Exception as e:
+                failed[name] = str(e)
+                logger.error(f"[{done}/{len(pairs)}] {name}: failed: {e}")
+            if progress:
+                progress('pairs', 100 * done / len(pairs))
+
+    elapsed = time.monotonic() - start
+    summary = {
+        'completed': len(outputs),
+        'failed': failed,
+        'seconds': round(elapsed, 1),
+        'papers_per_hour': round(len(outputs) / elapsed * 3600, 1) if elapsed else 0.0,
+        'outputs': [outputs[pair['name']] for pair in pairs if pair['name'] in outputs],
+        'merged_output': None,
+    }
+    if merged and outputs:
+        summary['merged_output'] = os.path.join(output_dir, 'merged_output.xlsx')
+        merge_workbooks([(pair['name'], outputs[pair['name']]) for pair in pairs if pair['name'] in outputs],
+                        summary['merged_output'])
+
+    logger.info(f"Processed {len(outputs)} of {len(pairs)} pairs in {elapsed:.1f}s "
+                f"({summary['papers_per_hour']} papers/hour), {len(failed)} failed")
+    return summary
+
+
+# Function to run a ZIP of pairs inside work_dir. Returns the merged workbook
+# or a ZIP of the per-pair workbooks.
+def run_batch_archive(archive_path, work_dir, merged=False, use_cache=True, progress=None, retry_failed=False):
+    input_dir = os.path.join(work_dir, 'input')
+    output_dir = os.path.join(work_dir, 'output')
+    extract_archive(archive_path, input_dir)
+
+    pairs, unpaired = pair_files(find_pdfs(input_dir), root=input_dir)
+    for path in unpaired:
+        logger.warning(f"No matching file for {os.path.relpath(path, input_dir)}")
+    if not pairs:
+        raise RuntimeError('No question paper/answer sheet pairs found in the archive')
+
+    summary = run_batch(pairs, output_dir, merged=merged, use_cache=use_cache, progress=progress,
+                        checkpoint_dir=os.path.join(work_dir, 'checkpoints'), retry_failed=retry_failed)
+    if not summary['completed']:
+        raise RuntimeError('All pairs failed: ' + '; '.join(f'{k}: {v}' for k, v in summary['failed'].items()))
+    if summary['merged_output']:
+        return summary['merged_output']
+    return shutil.make_archive(os.path.join(work_dir, 'final_outputs'), 'zip', output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='folder or ZIP file of question papers and answer sheets')
+    parser.add_argument('--output', default='batch_output', help='folder for the workbooks')
+    parser.add_argument('--merged', action='store_true', help='also write one merged workbook')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='pairs processed at once')
+    parser.add_argument('--bypass-cache', action='store_true', help='convert every PDF with Mathpix again')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='re-send only the questions that failed in an earlier run into the same --output')
+    args = parser.parse_args()
+
+    if zipfile.is_zipfile(args.input):
+        input_dir = os.path.join(args.output, 'input')
+        try:
+            extract_archive(args.input, input_dir)
+        except ArchiveTooLarge as e:
+            parser.error(str(e))
+    else:
+        input_dir = args.input
+
+    pairs, unpaired = pair_files(find_pdfs(input_dir), root=input_dir)
+    for path in unpaired:
+        logger.warning(f"No matching file for {path}")
+    if not pairs:
+        parser.error('no question paper/answer sheet pairs found')
+
+    # Checkpoints live with the output, so running the same command again resumes
+    with metrics.collect() as batch_metrics:
+        summary = run_batch(pairs, args.output, merged=args.merged, use_cache=not args.bypass_cache,
+                            workers=args.workers, checkpoint_dir=os.path.join(args.output, 'checkpoints'),
+                            retry_failed=args.retry_failed)
+    print(f"Timings:\n{batch_metrics.summary()}")
+    for name, error in summary['failed'].items():
+        print(f"Failed: {name}: {error}")
+    if summary['merged_output']:
+        print(f"Merged workbook: {summary['merged_output']}")
+    print(f"Papers per hour: {summary['papers_per_hour']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Accuracy and speed of AlignmentIndex against the old matching of
+solutions to questions by sequential block number, on synthetic papers
+with numbering drift.
+
+The question paper starts with an unnumbered instructions block. In the
+answer key some solutions have numbered steps, some are missing and some
+lost their printed number. Every solution carries a hidden #n# tag so the
+matches can be checked.
+
+    python benchmarks/bench_alignment.py --questions 2000
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alignment import AlignmentIndex
+from benchmarks.synthetic import blank_question, descriptive_question, objective_question
+from segmenter import segment_text
+
+TAG_PATTERN = re.compile(r"#(\d+)#")
+BUILDERS = [objective_question, blank_question, descriptive_question]
+
+
+# Returns the question paper, the answer key and the question numbers that
+# have a solution block of their own
+def make_drifted_paper(count, seed=0):
+    rng = random.Random(seed)
+    questions = ["General instructions: answer all questions. Write neatly."]
+    solutions = []
+    answerable = set()
+    for number in range(1, count + 1):
+        question = BUILDERS[(number - 1) % len(BUILDERS)](number, rng)
+        questions.append(question)
+        # The answer repeats a few words of the question, as answer keys do
+        echo = " ".join(re.findall(r"[A-Za-z]{4,}", question.split("\n")[0])[1:4])
+        if number % 40 == 0:
+            continue
+        prefix = "" if number % 55 == 0 else f"{number}. "
+        solution = f"{prefix}{echo} #{number}#"
+        if number % 25 == 0:
+            solution += "\n1) first point of the answer\n2) second point of the answer"
+        solutions.append(solution)
+        if prefix:
+            answerable.add(number)
+    return "\n\n".join(questions) + "\n", "\n\n".join(solutions) + "\n", answerable
+
+
+def score(questions, solution_texts, answerable):
+    correct = wrong = silent = missed = 0
+    for question, (text, confident) in zip(questions, solution_texts):
+        if question["label"] is None:
+            continue
+        number = int(question["label"])
+        tags = TAG_PATTERN.findall(text)
+        if number in answerable:
+            if tags[:1] == [str(number)]:
+                correct += 1
+            else:
+                missed += 1
+        elif tags:
+            wrong += 1
+            silent += confident
+    return correct, missed, wrong, silent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=2000)
+    args = parser.parse_args()
+    # Keep the alignment report out of the benchmark output
+    logging.disable(logging.WARNING)
+
+    question_text, solution_text, answerable = make_drifted_paper(args.questions)
+    questions = list(segment_text(question_text))
+    solutions = list(segment_text(solution_text))
+
+    start = time.perf_counter()
+    by_number = {solution["number"]: solution["text"] for solution in solutions}
+    sequential = [(by_number.get(question["number"], ""), True) for question in questions]
+    sequential_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = AlignmentIndex(solutions)
+    matches = [index.match(question) for question in questions]
+    index.report()
+    aligned_seconds = time.perf_counter() - start
+    aligned = [(match.text, match.confidence >= index.min_confidence) for match in matches]
+
+    print(f"{args.questions} questions, {len(answerable)} with a numbered solution, {len(solutions)} solution blocks")
+    print(f"{'':>16} {'correct':>8} {'missed':>7} {'wrong':>6} {'unflagged wrong':>16} {'flagged':>8} {'ms':>8}")
+    for label, results, flagged, seconds in [
+        ("block number", sequential, 0, sequential_seconds),
+        ("AlignmentIndex", aligned, len(index.low_confidence), aligned_seconds),
+    ]:
+        correct, missed, wrong, silent = score(questions, results, answerable)
+        print(f"{label:>16} {correct:>8} {missed:>7} {wrong:>6} {silent:>16} {flagged:>8} {seconds * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Throughput of the one-pass classify_questions against the old three
+passes (process_objective/subjective/descriptive_questions) on a large
+synthetic paper. Rows must match apart from Marks, which the classifier
+now takes from the bracketed marks in the question.
+
+    python benchmarks/bench_classifier.py --questions 50000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import app
+from benchmarks.synthetic import make_paper
+from segmenter import segment_text
+
+
+# The three sheet builders as they were before the classifier, reduced to
+# the fields that decide membership and content
+def legacy_classify(questions, solutions):
+    rows = {'Objective': [], 'Subjective': [], 'Descriptive': []}
+
+    solution_dict = {sol['number']: sol['text'] for sol in solutions}
+    for question in questions:
+        solution = solution_dict.get(question['number'], '')
+        question_text = re.sub(r'[a-dA-D][).] [^\n]+', '', question['text']).strip()
+        options = re.findall(r'[a-dA-D][).] [^\n]+', question['text'])
+        if len(options) == 4:
+            rows['Objective'].append((question['number'], question_text, tuple(options), solution))
+
+    solution_dict = {sol['number']: sol['text'] for sol in solutions}
+    for question in questions:
+        question_text = re.sub(r'[a-d][A-D]\) [^\n]+', '', question['text']).strip()
+        solution = solution_dict.get(question['number'], '')
+        if re.search(r'_{2,}', question_text):
+            rows['Subjective'].append((question['number'], question_text, solution))
+
+    solution_dict = {sol['number']: sol['text'] for sol in solutions}
+    for question in questions:
+        solution = solution_dict.get(question['number'], '')
+        question_text = question['text'].strip().replace('\n', ' ')
+        if (not re.findall(r'[a-dA-D][).] [^\n]+', question_text)
+                and not re.search(r'_{2,}', question_text)):
+            rows['Descriptive'].append((question['number'], question_text.strip(), solution.strip()))
+
+    return rows
+
+
+# Question text and the marks question_features should find in it
+MARKS_CASES = [
+    ("1. Explain the water cycle. (5)", 5),
+    ("2. State the law. [2 marks]\nGive an example.", 2),
+    ("3. Evaluate the limit of f(3)", None),
+    ("4. Explain ____ in f(2)", None),
+    ("5. Find g (4)", None),
+    ("6. Describe photosynthesis (3)", 3),
+    ("7. Solve it.\n(4)", 4),
+]
+
+
+def reduce_rows(rows):
+    return {
+        'Objective': [(int(row['Question Label'][1:]), row['Question'],
+                       tuple(row[f'Answer Content{i}'] for i in range(1, 5)), row['Answer Explanation'])
+                      for row in rows['Objective']],
+        'Subjective': [(int(row['Question Label'][1:]), row['Question'], row['answer_explanation'])
+                       for row in rows['Subjective']],
+        'Descriptive': [(int(row['Question Label'][1:]), row['Question'], row['Answer Explanation'])
+                        for row in rows['Descriptive']],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=50000)
+    args = parser.parse_args()
+
+    for text, marks in MARKS_CASES:
+        assert app.question_features({'text': text})['marks'] == marks, text
+
+    question_text, solution_text = make_paper(args.questions)
+    # A few questions with three options fit no sheet
+    question_text += f"{args.questions + 1}. Pick one\na) x\nb) y\nc) z\n"
+    questions = list(segment_text(question_text))
+    solutions = list(segment_text(solution_text))
+
+    start = time.perf_counter()
+    legacy = legacy_classify(questions, solutions)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows, unmatched = app.classify_questions(questions, solutions)
+    new_time = time.perf_counter() - start
+
+    assert reduce_rows(rows) == legacy, "classifier rows differ from the old sheet builders"
+    print(f"{len(questions)} questions: " + ", ".join(f"{name} {len(r)}" for name, r in rows.items())
+          + f", unmatched {len(unmatched)}")
+    print(f"three passes: {legacy_time:.3f}s ({len(questions) / legacy_time:,.0f} questions/s)")
+    print(f"one pass:     {new_time:.3f}s ({len(questions) / new_time:,.0f} questions/s)")
+
+
+if __name__ == "__main__":
+    main()
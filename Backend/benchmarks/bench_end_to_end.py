@@ -0,0 +1,203 @@
+"""End-to-end /upload benchmark against the fake Mathpix and OpenAI servers,
+with no network access needed.
+
+Each scenario posts a question paper and answer key to /upload through the
+Flask test client, with the Mathpix and GPT caches off. The fixtures
+scenario serves the recorded MMD in benchmarks/fixtures; the others are
+synthetic papers of Objective, fill-in-the-blank or Descriptive questions,
+or all three in turn. Every scenario runs in its own subprocess so peak RSS
+is not shared. The report has the time of each stage, questions per second
+and peak RSS. Stage times add up over threads, so stages run in parallel,
+such as gpt.call, can take longer than the whole upload.
+
+--save writes the results to benchmarks/results/<commit>.json; --compare
+prints the change from such a file, so runs on different commits can be
+set side by side.
+
+    python benchmarks/bench_end_to_end.py --questions 300 --save
+    git checkout other-branch
+    python benchmarks/bench_end_to_end.py --questions 300 --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+sys.path.insert(0, BACKEND_DIR)
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.stubs import FakeMathpixHandler, FakeOpenAIHandler, load_mmd_fixture, start_stub_server
+from benchmarks.synthetic import make_paged_paper, make_pdf
+
+SCENARIOS = {
+    "fixtures": None,
+    "objective": ("objective",),
+    "blank": ("blank",),
+    "descriptive": ("descriptive",),
+    "mixed": ("objective", "blank", "descriptive"),
+}
+# Settings that change the pipeline, saved with the results
+SETTINGS = ["MATHPIX_PAGES_PER_CHUNK", "PIPELINE_CHUNK_SIZE", "GPT_MAX_WORKERS", "GPT_MAX_CONCURRENT",
+            "MATHPIX_MAX_CONCURRENT"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_scenario(directory):
+    import io
+    import pandas as pd
+    import app
+    app.gpt_cache.enabled = False
+
+    client = app.app.test_client()
+    with open(os.path.join(directory, "questions.pdf"), "rb") as questions, \
+            open(os.path.join(directory, "answers.pdf"), "rb") as answers:
+        start = time.perf_counter()
+        response = client.post("/upload", data={
+            "questionPaper": (questions, "questions.pdf"),
+            "answerSheet": (answers, "answers.pdf"),
+            "bypassCache": "true",
+        })
+        workbook = response.get_data()
+        seconds = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"/upload answered {response.status_code}: {workbook[:200]!r}")
+    frames = pd.read_excel(io.BytesIO(workbook), sheet_name=None)
+    return {
+        "seconds": round(seconds, 3),
+        "rows": {sheet_name: len(df) for sheet_name, df in frames.items()},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": {name: timer["seconds"] for name, timer in app.metrics.registry.snapshot()["timers"].items()},
+    }
+
+
+def write_scenario(directory, name, questions, questions_per_page):
+    if SCENARIOS[name] is None:
+        question_pages = load_mmd_fixture("science_questions.mmd")
+        answer_pages = load_mmd_fixture("science_answers.mmd")
+    else:
+        question_pages, answer_pages = make_paged_paper(questions, questions_per_page, kinds=SCENARIOS[name])
+    for file_name, pages in [("questions.pdf", question_pages), ("answers.pdf", answer_pages)]:
+        with open(os.path.join(directory, file_name), "wb") as f:
+            f.write(make_pdf(len(pages), f"{name}-{file_name}"))
+    return {"questions.pdf": question_pages, "answers.pdf": answer_pages}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                               check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def print_results(results, baseline=None):
+    baseline = baseline or {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        questions = sum(result["rows"].values())
+        line = (f"{name:>12}: {result['seconds']:7.2f}s, {questions} rows, "
+                f"{questions / result['seconds']:7.1f} questions/s, peak RSS {result['peak_rss_mb']:.0f} MB")
+        if before:
+            line += (f"  ({change(before['seconds'], result['seconds'])} time, "
+                     f"{change(before['peak_rss_mb'], result['peak_rss_mb'])} RSS)")
+        print(line)
+        for stage, seconds in result["stages"].items():
+            line = f"{'':>14}{stage:<24} {seconds:8.2f}s"
+            if before and stage in before["stages"]:
+                line += f"  ({change(before['stages'][stage], seconds)})"
+            print(line)
+
+
+def change(before, after):
+    if not before:
+        return "n/a"
+    return f"{100 * (after - before) / before:+.0f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--questions", type=int, default=300, help="questions in each synthetic paper")
+    parser.add_argument("--questions-per-page", type=int, default=15)
+    parser.add_argument("--mathpix-startup", type=float, default=0.5, help="seconds before a job starts")
+    parser.add_argument("--seconds-per-page", type=float, default=0.05)
+    parser.add_argument("--percent-step", type=float, default=0, help="coarse percent_done steps, 0 for smooth")
+    parser.add_argument("--capacity", type=int, default=0, help="Mathpix jobs worked on at once, 0 for no limit")
+    parser.add_argument("--gpt-latency", type=float, default=0.05)
+    parser.add_argument("--save", action="store_true", help="write the results to benchmarks/results")
+    parser.add_argument("--compare", help="results file to compare with")
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.directory:
+        print(json.dumps(run_scenario(args.directory)))
+        return
+
+    mathpix_server = start_stub_server(
+        FakeMathpixHandler, startup=args.mathpix_startup, seconds_per_page=args.seconds_per_page,
+        percent_step=args.percent_step, capacity=args.capacity, documents={}
+    )
+    openai_server = start_stub_server(FakeOpenAIHandler, latency=args.gpt_latency)
+    env = dict(
+        os.environ,
+        MATHPIX_API_URL=mathpix_server.base_url + "/v3",
+        MATHPIX_POLL_MIN_INTERVAL="0.1",
+        MATHPIX_POLL_MAX_INTERVAL="0.5",
+        OPENAI_API_BASE=openai_server.base_url + "/v1",
+        OPENAI_API_KEY="sk-stub",
+        GPT_REQUESTS_PER_MINUTE="100000000",
+        GPT_TOKENS_PER_MINUTE="100000000000",
+    )
+
+    results = {}
+    for name in args.scenarios.split(","):
+        directory = tempfile.mkdtemp()
+        # The stub keeps the config dict, so it serves the new papers from here on
+        mathpix_server.config["documents"] = write_scenario(directory, name, args.questions, args.questions_per_page)
+        output = subprocess.run([sys.executable, __file__, "--directory", directory], check=True, capture_output=True,
+                                text=True, env=dict(env, CACHE_DIR=os.path.join(directory, "cache"))).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+    mathpix_server.shutdown()
+    openai_server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        print(f"compared with {saved['commit']} from {saved['date']}")
+    print_results(results, baseline)
+
+    if args.save:
+        commit = git_commit()
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{commit}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": commit,
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "arguments": {key: value for key, value in vars(args).items()
+                              if key not in ("save", "compare", "directory")},
+                "settings": {name: os.environ[name] for name in SETTINGS if name in os.environ},
+                "results": results,
+            }, f, indent=2)
+        print(f"saved to {os.path.relpath(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Prompt tokens per question and GPT calls per paper for batched prompts.
+
+Runs an Objective sheet through enrich_sheet_with_gpt against the fake
+OpenAI server for each batch size and counts what was actually sent.
+
+    python benchmarks/bench_gpt_batching.py --questions 60
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import app
+from benchmarks.bench_gpt_enrichment import make_objective_sheet
+from benchmarks.stubs import FakeOpenAIHandler, start_stub_server, use_fake_openai
+from enrichment import RateLimiter
+
+
+def count_tokens(text):
+    try:
+        import tiktoken
+        return len(tiktoken.encoding_for_model("gpt-4").encode(text))
+    except ImportError:
+        return len(text) // 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=60)
+    parser.add_argument("--batch-sizes", default="1,5,10,20")
+    args = parser.parse_args()
+    # Every question has to reach the fake server, not the GPT cache
+    app.gpt_cache.enabled = False
+
+    print(f"{'batch size':>10} {'calls/paper':>12} {'prompt tokens/question':>24}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        server = start_stub_server(FakeOpenAIHandler, latency=0)
+        use_fake_openai(server)
+        limiter = RateLimiter(requests_per_minute=100000, tokens_per_minute=100000000)
+        app.enrich_sheet_with_gpt(make_objective_sheet(args.questions), 'Objective',
+                                  limiter=limiter, batch_size=batch_size)
+        prompt_tokens = sum(
+            count_tokens(message["content"]) for payload in server.payloads for message in payload["messages"]
+        )
+        print(f"{batch_size:>10} {server.request_count:>12} {prompt_tokens / args.questions:>24.1f}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark of the concurrent GPT enrichment engine against a local fake
+OpenAI server with fixed latency per call.
+
+    python benchmarks/bench_gpt_enrichment.py --questions 100 --latency 1 --workers 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Let --workers decide concurrency rather than the process-wide cap
+os.environ.setdefault("GPT_MAX_CONCURRENT", "1000")
+
+import pandas as pd
+
+import app
+from benchmarks.stubs import FakeOpenAIHandler, start_stub_server, use_fake_openai
+from enrichment import RateLimiter
+
+
+def make_objective_sheet(count):
+    return pd.DataFrame({
+        'Question Label': [f'Q{i + 1}' for i in range(count)],
+        'Question': [f'{i + 1}. What is {i} + {i}?' for i in range(count)],
+        'Marks': [1] * count,
+    })
+
+
+def run(count, workers):
+    df = make_objective_sheet(count)
+    # Generous budgets so the benchmark measures concurrency, not throttling
+    limiter = RateLimiter(requests_per_minute=100000, tokens_per_minute=100000000)
+    start = time.perf_counter()
+    df = app.enrich_sheet_with_gpt(df, 'Objective', max_workers=workers, limiter=limiter)
+    elapsed = time.perf_counter() - start
+    filled = (df['Question Category'] != "").sum()
+    return elapsed, filled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--serial", action="store_true",
+                        help="also time a real serial run instead of estimating it")
+    args = parser.parse_args()
+    # Every question has to reach the fake server, not the GPT cache
+    app.gpt_cache.enabled = False
+
+    server = start_stub_server(FakeOpenAIHandler, latency=args.latency)
+    use_fake_openai(server)
+
+    parallel_time, filled = run(args.questions, args.workers)
+    if args.serial:
+        serial_time, _ = run(args.questions, 1)
+    else:
+        serial_time = args.questions * args.latency
+
+    print(f"questions:      {args.questions} ({filled} filled)")
+    print(f"latency/call:   {args.latency:.2f}s")
+    print(f"serial:         {serial_time:.2f}s{'' if args.serial else ' (estimated)'}")
+    print(f"{args.workers} workers:     {parallel_time:.2f}s")
+    print(f"speedup:        {serial_time / parallel_time:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""End-to-end time and peak RSS of the old Excel round-trip pipeline versus
+run_pipeline, which passes the sheet frames straight to the GPT stage.
+
+GPT answers are canned in-process so only the pipeline itself is measured.
+Each mode runs in its own subprocess so peak RSS is not shared.
+
+    python benchmarks/bench_inmemory_pipeline.py --questions 2000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.stubs import details_reply
+from benchmarks.synthetic import write_paper
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode, questions):
+    import contextlib
+    # Lift the GPT rate limits; only the pipeline itself is being measured
+    os.environ["GPT_REQUESTS_PER_MINUTE"] = "100000000"
+    os.environ["GPT_TOKENS_PER_MINUTE"] = "100000000000"
+    import app
+    app.gpt_cache.enabled = False
+    app.get_question_details = lambda sheet_type, question_content, fields=None: details_reply(sheet_type, fields)
+
+    directory = tempfile.mkdtemp()
+    questions_file, solutions_file = write_paper(directory, questions)
+    output_path = os.path.join(directory, "final_output.xlsx")
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if mode == "excel":
+            intermediate_path = os.path.join(directory, "intermediate_output.xlsx")
+            app.process_files_to_excel(questions_file, solutions_file, intermediate_path)
+            app.process_excel_file_with_gpt(intermediate_path, output_path)
+        else:
+            app.run_pipeline(questions_file, solutions_file, output_path)
+    return {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--mode", choices=["excel", "memory"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.questions)))
+        return
+
+    print(f"{args.questions} questions")
+    for mode, label in [("excel", "intermediate workbook"), ("memory", "in-memory frames")]:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--questions", str(args.questions)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{label:>22}: {result['seconds']:6.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Equivalence and speed of the vectorized mark_correct_answers.
+
+First checks the vectorized version against the old row-by-row loop on
+many randomly generated objective sheets (including missing options,
+missing marks, non-string explanations and letters outside a-d), then
+times both at 10k and 100k rows.
+
+    python benchmarks/bench_mark_correct_answers.py --cases 300 --rows 10000,100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import numpy as np
+import pandas as pd
+
+import app
+
+
+# mark_correct_answers as it was before vectorization
+def legacy_mark_correct_answers(objective_df):
+    for index, row in objective_df.iterrows():
+        correct_answer = app.extract_correct_answer(row['Answer Explanation'])
+
+        for i in range(1, 5):
+            answer_content = row[f'Answer Content{i}']
+            if pd.isna(answer_content):
+                objective_df.at[index, f'Correct Answer{i}'] = 'No'
+                objective_df.at[index, f'Answer Weightage{i}'] = 0
+            elif correct_answer and answer_content.startswith(f"{correct_answer})"):
+                objective_df.at[index, f'Correct Answer{i}'] = 'Yes'
+                objective_df.at[index, f'Answer Weightage{i}'] = row['Marks'] if not pd.isna(row['Marks']) else 0
+            else:
+                objective_df.at[index, f'Correct Answer{i}'] = 'No'
+                objective_df.at[index, f'Answer Weightage{i}'] = 0
+
+    return objective_df
+
+
+def random_explanation(rng):
+    choice = rng.random()
+    if choice < 0.05:
+        return rng.choice([None, np.nan, "", 3])
+    letter = rng.choice("abcdABCDefz")
+    before = rng.choice(["(", " ", "", "x"])
+    after = rng.choice([")", ".", " ", "", "]"])
+    return rng.choice(["", "Answer", "The answer is"]) + before + letter + after + rng.choice(["", " as shown", "\n"])
+
+
+def random_option(rng, position):
+    if rng.random() < 0.05:
+        return np.nan
+    letter = rng.choice(["abcd"[position], "abcd"[position].upper(), rng.choice("abcd")])
+    return letter + rng.choice([")", ".", ") "]) + rng.choice([" 4", " x + 1", ""])
+
+
+def random_sheet(rng, rows):
+    data = []
+    for _ in range(rows):
+        row = {'Marks': rng.choice([1, 1, 2, np.nan]), 'Answer Explanation': random_explanation(rng)}
+        for i in range(1, 5):
+            row[f'Answer Content{i}'] = random_option(rng, i - 1)
+            row[f'Correct Answer{i}'] = 'No'
+            row[f'Answer Weightage{i}'] = 0
+        data.append(row)
+    return pd.DataFrame(data)
+
+
+def check_equivalence(cases, seed=0):
+    rng = random.Random(seed)
+    for case in range(cases):
+        df = random_sheet(rng, rng.randint(0, 30))
+        expected = legacy_mark_correct_answers(df.copy())
+        actual = app.mark_correct_answers(df.copy())
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, obj=f"case {case}")
+    print(f"vectorized result matches the row-by-row loop on {cases} random sheets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cases", type=int, default=300)
+    parser.add_argument("--rows", default="10000,100000")
+    args = parser.parse_args()
+
+    check_equivalence(args.cases)
+    rng = random.Random(1)
+    for rows in [int(count) for count in args.rows.split(",")]:
+        df = random_sheet(rng, rows)
+        start = time.perf_counter()
+        legacy_mark_correct_answers(df.copy())
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        app.mark_correct_answers(df.copy())
+        new_time = time.perf_counter() - start
+        print(f"{rows:>7} rows: loop {legacy_time:7.3f}s, vectorized {new_time:6.3f}s "
+              f"({legacy_time / new_time:,.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Connection setups and per-poll latency of the pooled Mathpix client against
+one-off requests.get calls, using the fake Mathpix server over HTTPS.
+
+Several threads poll the status of one PDF, as the poller and concurrent
+jobs do. With --error-every N every N-th request gets a 503, which both
+see as a failed poll; status polls are not retried, the poller polls again.
+
+    python benchmarks/bench_mathpix_client.py --polls 200 --threads 4 --error-every 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import mathpix
+from benchmarks.stubs import FakeMathpixHandler, make_self_signed_cert, start_stub_server
+
+
+def run(server, get_status, pdf_id, polls, threads):
+    def poll(_):
+        start = time.perf_counter()
+        try:
+            ok = get_status(pdf_id).get("status") == "completed"
+        except (requests.RequestException, ValueError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    connections = server.connection_count
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(poll, range(polls)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "connections": server.connection_count - connections,
+        "failed": sum(1 for _, ok in results if not ok),
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--error-every", type=int, default=0)
+    args = parser.parse_args()
+
+    certfile, keyfile = make_self_signed_cert(tempfile.mkdtemp())
+    os.environ["REQUESTS_CA_BUNDLE"] = certfile
+    server = start_stub_server(FakeMathpixHandler, certfile=certfile, keyfile=keyfile, startup=0,
+                               seconds_per_page=0, error_every=args.error_every)
+    base_url = server.base_url + "/v3"
+    pdf_id = requests.post(f"{base_url}/pdf", files={"file": ("paper.pdf", b"x" * 1000)}).json()["pdf_id"]
+
+    def one_off(pdf_id):
+        return requests.get(f"{base_url}/pdf/{pdf_id}.json", headers={"app_id": "", "app_key": ""}).json()
+
+    client = mathpix.MathpixClient(base_url)
+    print(f"{args.polls} status polls over HTTPS from {args.threads} threads")
+    print(f"{'':>18} {'connections':>12} {'failed':>7} {'mean ms':>8} {'p95 ms':>8} {'total s':>8}")
+    for name, get_status in [("requests.get", one_off), ("MathpixClient", client.get_status)]:
+        result = run(server, get_status, pdf_id, args.polls, args.threads)
+        print(f"{name:>18} {result['connections']:>12} {result['failed']:>7} {result['mean_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['seconds']:>8.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Time-to-completion of the adaptive Mathpix poller against the old fixed
+schedule (13 s between polls, 10 polls), using the fake Mathpix server.
+
+All times are scaled by --time-scale so the run finishes quickly; reported
+numbers are converted back to real seconds.
+
+    python benchmarks/bench_mathpix_polling.py --pages 1,2,3,5,8,12,20,30,50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import mathpix
+from benchmarks.stubs import FakeMathpixHandler, start_stub_server
+
+
+# The polling loop as it was before the adaptive poller
+def legacy_poll_status(pdf_id, headers, poll_interval=13, max_polls=10):
+    url = f"{mathpix.MATHPIX_API_URL}/pdf/{pdf_id}.json"
+    for poll_count in range(max_polls):
+        status_data = requests.get(url, headers=headers).json()
+        if status_data.get("status") == "completed":
+            return status_data
+        time.sleep(poll_interval)
+    return None
+
+
+def submit(pages, bytes_per_page):
+    response = requests.post(f"{mathpix.MATHPIX_API_URL}/pdf", files={"file": ("paper.pdf", b"x" * pages * bytes_per_page)})
+    return response.json()["pdf_id"]
+
+
+def run(pages_list, wait, bytes_per_page):
+    def convert(pages):
+        start = time.monotonic()
+        result = wait(submit(pages, bytes_per_page))
+        return time.monotonic() - start, result is not None
+
+    with ThreadPoolExecutor(max_workers=len(pages_list)) as executor:
+        return list(executor.map(convert, pages_list))
+
+
+def report(name, results, pages_list, scale):
+    completed = [elapsed / scale for elapsed, ok in results if ok]
+    print(f"{name}: {len(completed)}/{len(results)} completed, "
+          f"median {statistics.median(completed):.1f}s" if completed else f"{name}: none completed")
+    for pages, (elapsed, ok) in zip(pages_list, results):
+        print(f"  {pages:>3} pages: {elapsed / scale:6.1f}s {'' if ok else '(gave up)'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", default="1,2,3,5,8,12,20,30,50")
+    parser.add_argument("--seconds-per-page", type=float, default=3.0)
+    parser.add_argument("--startup", type=float, default=3.0)
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    args = parser.parse_args()
+
+    scale = args.time_scale
+    bytes_per_page = 1000
+    pages_list = [int(pages) for pages in args.pages.split(",")]
+    server = start_stub_server(FakeMathpixHandler, bytes_per_page=bytes_per_page, startup=args.startup * scale,
+                               seconds_per_page=args.seconds_per_page * scale)
+    mathpix.MATHPIX_API_URL = server.base_url + "/v3"
+    client = mathpix.MathpixClient(mathpix.MATHPIX_API_URL)
+
+    legacy = run(pages_list, lambda pdf_id: legacy_poll_status(pdf_id, {}, poll_interval=13 * scale), bytes_per_page)
+    poller = mathpix.MathpixPoller(
+        get_status=client.get_status,
+        min_interval=mathpix.MATHPIX_POLL_MIN_INTERVAL * scale,
+        max_interval=mathpix.MATHPIX_POLL_MAX_INTERVAL * scale,
+        base_deadline=mathpix.MATHPIX_BASE_DEADLINE * scale,
+        deadline_per_page=mathpix.MATHPIX_DEADLINE_PER_PAGE * scale,
+        max_deadline=mathpix.MATHPIX_MAX_DEADLINE * scale,
+    )
+    adaptive = run(pages_list, lambda pdf_id: poller.wait(pdf_id), bytes_per_page)
+
+    report("fixed 13s schedule", legacy, pages_list, scale)
+    report("adaptive poller", adaptive, pages_list, scale)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Peak RSS and time of one Mathpix conversion with the old buffered upload
+and download versus the streamed ones, against the fake Mathpix server.
+
+The buffered mode builds the multipart body in memory with files=, reads the
+whole MMD response and cleans it with str.replace, as the backend used to.
+The streamed mode goes through convert_with_mathpix. Each mode runs in its
+own subprocess so peak RSS is not shared; both must write the same MMD.
+
+    python benchmarks/bench_mathpix_streaming.py --pdf-mb 100 --mmd-mb 20
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.stubs import FakeMathpixHandler, start_stub_server
+
+# MMD with every pattern the cleanup removes, some split across chunk edges
+MMD_BLOCK = "\\section*{Section A}\n1. Fill in the blank: $x^{2}$ is $\\qquad$ when $x = 3$.\n(a) 6\n(b) 9\n"
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run_mode(mode, pdf_path):
+    import requests
+    from werkzeug.datastructures import FileStorage
+    import app
+
+    start = time.perf_counter()
+    with open(pdf_path, "rb") as stream:
+        if mode == "buffered":
+            response = requests.post(
+                f"{app.mathpix_client.base_url}/pdf",
+                data={"options_json": json.dumps(app.mathpix_options)},
+                files={"file": ("paper.pdf", stream, "application/pdf")},
+            )
+            pdf_id = response.json()["pdf_id"]
+            app.poll_status(pdf_id)
+            mmd_content = requests.get(f"{app.mathpix_client.base_url}/pdf/{pdf_id}.mmd").text
+            mmd_content = mmd_content.replace("{", "").replace("}", "").replace(r"\section*", "").replace(r"$\qquad$", "__")
+            mmd_path = app.new_mmd_temp_path()
+            with open(mmd_path, "w", encoding="utf-8", newline="") as f:
+                f.write(mmd_content)
+        else:
+            mmd_path = app.convert_with_mathpix(FileStorage(stream, "paper.pdf", content_type="application/pdf"))
+    seconds = time.perf_counter() - start
+    result = {"seconds": seconds, "peak_rss_mb": peak_rss_mb(), "sha256": file_sha256(mmd_path)}
+    os.remove(mmd_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf-mb", type=int, default=100)
+    parser.add_argument("--mmd-mb", type=int, default=20)
+    parser.add_argument("--mode", choices=["buffered", "streamed"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.pdf)))
+        return
+
+    mmd = MMD_BLOCK * (args.mmd_mb * 1024 * 1024 // len(MMD_BLOCK))
+    server = start_stub_server(FakeMathpixHandler, startup=0, seconds_per_page=0, bytes_per_page=10 ** 9, mmd=mmd)
+    directory = tempfile.mkdtemp()
+    pdf_path = os.path.join(directory, "paper.pdf")
+    with open(pdf_path, "wb") as f:
+        for _ in range(args.pdf_mb):
+            f.write(os.urandom(1024 * 1024))
+
+    env = dict(os.environ, MATHPIX_API_URL=server.base_url + "/v3", MATHPIX_POLL_MIN_INTERVAL="0.05")
+    print(f"{args.pdf_mb} MB PDF, {len(mmd.encode('utf-8')) / 1024 / 1024:.0f} MB MMD")
+    hashes = set()
+    for mode in ["buffered", "streamed"]:
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--pdf", pdf_path],
+                                check=True, capture_output=True, text=True, env=env).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        hashes.add(result["sha256"])
+        print(f"{mode:>10}: {result['seconds']:6.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    print("cleaned MMD identical" if len(hashes) == 1 else "cleaned MMD DIFFERS")
+    os.remove(pdf_path)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
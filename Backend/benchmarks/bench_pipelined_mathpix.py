@@ -0,0 +1,107 @@
+"""Time to the final workbook for a paper converted by Mathpix in one piece
+versus in page chunks, with parsing and GPT running while later chunks are
+still in OCR (MATHPIX_PAGES_PER_CHUNK).
+
+The fake Mathpix server converts the synthetic pages at a fixed time per
+page, working on --capacity jobs at once; the fake OpenAI server answers
+after a fixed delay. Each mode runs process_pdf_pair in its own subprocess;
+both must produce the same workbook.
+
+    python benchmarks/bench_pipelined_mathpix.py --questions 200 --pages 20 --pages-per-chunk 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.stubs import FakeMathpixHandler, FakeOpenAIHandler, start_stub_server
+from benchmarks.synthetic import make_paged_paper, make_pdf
+
+
+def run_mode(directory):
+    import pandas as pd
+    import app
+    app.gpt_cache.enabled = False
+
+    output_path = os.path.join(directory, f"final_output_{os.getpid()}.xlsx")
+    start = time.perf_counter()
+    with app.metrics.collect() as run_metrics:
+        app.process_pdf_pair(os.path.join(directory, "questions.pdf"), "questions.pdf",
+                             os.path.join(directory, "answers.pdf"), "answers.pdf", output_path, use_cache=False)
+    seconds = time.perf_counter() - start
+    frames = pd.read_excel(output_path, sheet_name=None)
+    digest = hashlib.sha256("".join(df.to_csv() for df in frames.values()).encode("utf-8")).hexdigest()
+    timers = run_metrics.snapshot()["timers"]
+    return {
+        "seconds": seconds,
+        "questions": sum(len(df) for df in frames.values()),
+        "mathpix_wait": timers.get("mathpix.pipeline_wait", {}).get("seconds", 0),
+        "gpt_seconds": timers.get("gpt.enrichment", {}).get("seconds", 0),
+        "sha256": digest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--pages-per-chunk", type=int, default=4)
+    parser.add_argument("--seconds-per-page", type=float, default=0.5)
+    parser.add_argument("--capacity", type=int, default=4)
+    parser.add_argument("--gpt-latency", type=float, default=0.2)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.directory:
+        print(json.dumps(run_mode(args.directory)))
+        return
+
+    per_page = -(-args.questions // args.pages)
+    question_pages, answer_pages = make_paged_paper(args.questions, per_page)
+    mathpix_server = start_stub_server(
+        FakeMathpixHandler, startup=1.0, seconds_per_page=args.seconds_per_page, capacity=args.capacity,
+        documents={"questions.pdf": question_pages, "answers.pdf": answer_pages}
+    )
+    openai_server = start_stub_server(FakeOpenAIHandler, latency=args.gpt_latency)
+
+    directory = tempfile.mkdtemp()
+    for name, pages in [("questions.pdf", question_pages), ("answers.pdf", answer_pages)]:
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(make_pdf(len(pages), name))
+    env = dict(
+        os.environ,
+        MATHPIX_API_URL=mathpix_server.base_url + "/v3",
+        MATHPIX_POLL_MIN_INTERVAL="0.1",
+        MATHPIX_POLL_MAX_INTERVAL="0.5",
+        OPENAI_API_BASE=openai_server.base_url + "/v1",
+        OPENAI_API_KEY="sk-stub",
+        CACHE_DIR=os.path.join(directory, "cache"),
+        GPT_REQUESTS_PER_MINUTE="100000000",
+        GPT_TOKENS_PER_MINUTE="100000000000",
+    )
+
+    print(f"{args.questions} questions on {len(question_pages)} pages, {args.seconds_per_page}s per page, "
+          f"{args.capacity} Mathpix jobs at once, {args.gpt_latency}s per GPT call")
+    hashes = set()
+    for label, pages_per_chunk in [("whole PDFs", 0), (f"{args.pages_per_chunk}-page chunks", args.pages_per_chunk)]:
+        output = subprocess.run([sys.executable, __file__, "--directory", directory], check=True, capture_output=True,
+                                text=True, env=dict(env, MATHPIX_PAGES_PER_CHUNK=str(pages_per_chunk))).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        hashes.add(result["sha256"])
+        print(f"{label:>16}: {result['seconds']:6.2f}s to the workbook, {result['questions']} rows, "
+              f"GPT {result['gpt_seconds']:.2f}s, waiting on Mathpix mid-pipeline {result['mathpix_wait']:.2f}s")
+    print("workbooks identical" if len(hashes) == 1 else "workbooks DIFFER")
+    mathpix_server.shutdown()
+    openai_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
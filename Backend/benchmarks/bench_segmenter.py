@@ -0,0 +1,107 @@
+"""Scaling of the streaming segmenter against the old parse_questions on
+multi-megabyte Mathpix text, including one paper with very long blocks.
+
+    python benchmarks/bench_segmenter.py --sizes 1,2,4,8
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_paper
+from segmenter import segment_file, segment_text
+
+
+# parse_questions as it was before the segmenter
+def legacy_parse(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+
+    questions = []
+    lines = content.split('\n')
+    current_question = ""
+    question_number = 1
+
+    for line in lines:
+        if line.strip():
+            if re.match(r'^\(?\s*([0-9]+)\s*[\).]', line, re.IGNORECASE):
+                if current_question:
+                    questions.append({'text': current_question.strip(), 'number': question_number})
+                    question_number += 1
+                current_question = line.strip()
+            else:
+                current_question += "\n" + line.strip()
+
+    if current_question:
+        questions.append({'text': current_question.strip(), 'number': question_number})
+
+    return questions
+
+
+def make_text(megabytes, long_blocks):
+    if long_blocks:
+        # A handful of questions, each with thousands of continuation lines
+        line = "Continue the derivation using the previous step and simplify.\n"
+        lines_per_block = int(megabytes * 1024 * 1024 / len(line) / 4)
+        return "".join(f"{n}. Prove the identity.\n" + line * lines_per_block for n in range(1, 5))
+    text, _ = make_paper(1000)
+    return text * max(1, round(megabytes * 1024 * 1024 / len(text)))
+
+
+# Section headers inside the question list are dropped from the text; question lines that only start
+# with the same words must stay
+SECTION_PAPER = """Section A
+1. Sections of a stem are shown.
+Parts of a flower
+SECTION - B (1 mark each)
+2. Name the part.
+Part II: [5 marks]
+3. Answer both parts.
+Part A: State Ohm's law.
+Part B: Define resistance.
+Section 2 - Find x.
+"""
+SECTION_EXPECTED = [
+    ("1. Sections of a stem are shown.\nParts of a flower", "A"),
+    ("2. Name the part.", "B"),
+    ("3. Answer both parts.\nPart A: State Ohm's law.\nPart B: Define resistance.\nSection 2 - Find x.", "II"),
+]
+
+
+def timed(parse, path):
+    start = time.perf_counter()
+    records = parse(path)
+    return time.perf_counter() - start, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1,2,4,8", help="input sizes in MB")
+    args = parser.parse_args()
+
+    records = [r for r in segment_text(SECTION_PAPER) if r['label'] is not None]
+    assert [(r['text'], r['section']) for r in records] == SECTION_EXPECTED, records
+
+    directory = tempfile.mkdtemp()
+    print(f"{'input':>18} {'MB':>5} {'legacy s':>9} {'segmenter s':>12} {'segmenter MB/s':>15}")
+    for long_blocks in (False, True):
+        for megabytes in [float(size) for size in args.sizes.split(",")]:
+            path = os.path.join(directory, "paper.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(make_text(megabytes, long_blocks))
+            size = os.path.getsize(path) / 1024 / 1024
+
+            legacy_time, legacy = timed(legacy_parse, path)
+            new_time, records = timed(lambda p: list(segment_file(p)), path)
+            assert [(r['text'], r['number']) for r in records] == [(r['text'], r['number']) for r in legacy]
+
+            label = "long blocks" if long_blocks else "many questions"
+            print(f"{label:>18} {size:5.1f} {legacy_time:9.3f} {new_time:12.3f} {size / new_time:15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Peak RSS of the streaming, chunked run_pipeline against building every
+frame in full and writing it with pd.ExcelWriter, as the row count grows.
+
+GPT answers are canned in-process. Each run is a separate subprocess so
+peak RSS is measured per run.
+
+    python benchmarks/bench_streaming_writer.py --questions 10000,50000,100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the pipeline logs out of the benchmark output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.bench_inmemory_pipeline import peak_rss_mb
+from benchmarks.stubs import details_reply
+from benchmarks.synthetic import write_paper
+
+
+def load_app():
+    import app
+    app.gpt_cache.enabled = False
+    app.get_question_details = lambda sheet_type, question_content, fields=None: details_reply(sheet_type, fields)
+    return app
+
+
+def run_mode(mode, questions, directory):
+    import contextlib
+    os.environ["GPT_REQUESTS_PER_MINUTE"] = "100000000"
+    os.environ["GPT_TOKENS_PER_MINUTE"] = "100000000000"
+    app = load_app()
+
+    questions_file, solutions_file = write_paper(directory, questions)
+    output_path = os.path.join(directory, f"{mode}.xlsx")
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if mode == "full":
+            frames = app.enrich_frames_with_gpt(app.build_question_frames(questions_file, solutions_file))
+            app.write_frames_to_excel(frames, output_path)
+        else:
+            app.run_pipeline(questions_file, solutions_file, output_path)
+    return {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb(), "baseline_mb": baseline}
+
+
+def run_subprocess(mode, questions, directory):
+    output = subprocess.run(
+        [sys.executable, __file__, "--mode", mode, "--questions", str(questions), "--directory", directory],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check_same_output(directory):
+    import pandas as pd
+    for mode in ("full", "streaming"):
+        run_subprocess(mode, 300, directory)
+    full = pd.read_excel(os.path.join(directory, "full.xlsx"), sheet_name=None)
+    streaming = pd.read_excel(os.path.join(directory, "streaming.xlsx"), sheet_name=None)
+    assert list(full) == list(streaming)
+    for sheet_name in full:
+        pd.testing.assert_frame_equal(streaming[sheet_name], full[sheet_name], check_dtype=False)
+    print("streaming workbook matches the pd.ExcelWriter workbook")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", default="10000,50000,100000")
+    parser.add_argument("--mode", choices=["full", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, int(args.questions), args.directory)))
+        return
+
+    check_same_output(tempfile.mkdtemp())
+    print(f"{'questions':>9} {'full s':>8} {'full MB':>8} {'streaming s':>12} {'streaming MB':>13}")
+    for questions in [int(count) for count in args.questions.split(",")]:
+        full = run_subprocess("full", questions, tempfile.mkdtemp())
+        streaming = run_subprocess("streaming", questions, tempfile.mkdtemp())
+        print(f"{questions:>9} {full['seconds']:8.1f} {full['peak_rss_mb']:8.0f} "
+              f"{streaming['seconds']:12.1f} {streaming['peak_rss_mb']:13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Throughput and latency of concurrent /upload requests to the app under
+gunicorn (gunicorn.conf.py), against the fake Mathpix and OpenAI servers.
+
+Each upload is a different synthetic paper, so none is served from the
+Mathpix cache. The server is started afresh for each --workers value with
+its own cache and jobs directories, and stopped with SIGTERM so the run
+also goes through graceful shutdown.
+
+    python benchmarks/load_test.py --uploads 40 --concurrency 8 --workers 1,4
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import requests
+
+from benchmarks.stubs import FakeMathpixHandler, FakeOpenAIHandler, start_stub_server
+from benchmarks.synthetic import make_paged_paper, make_pdf
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, threads, env, port, timeout=60):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+        cwd=BACKEND_DIR, env=dict(env, WEB_WORKERS=str(workers), WEB_THREADS=str(threads), BIND=f"127.0.0.1:{port}",
+                                  WEB_ACCESS_LOG="/dev/null"),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def upload(url, directory, number):
+    with open(os.path.join(directory, f"questions-{number}.pdf"), "rb") as questions, \
+            open(os.path.join(directory, f"answers-{number}.pdf"), "rb") as answers:
+        start = time.perf_counter()
+        response = requests.post(url, files={
+            "questionPaper": (f"questions-{number}.pdf", questions, "application/pdf"),
+            "answerSheet": (f"answers-{number}.pdf", answers, "application/pdf"),
+        })
+        seconds = time.perf_counter() - start
+    return response.status_code == 200 and response.content.startswith(b"PK"), seconds
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uploads", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", default="1,4", help="comma-separated gunicorn worker counts to compare")
+    parser.add_argument("--threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--mathpix-seconds", type=float, default=1.0, help="Mathpix time per paper")
+    parser.add_argument("--gpt-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    question_pages, answer_pages = make_paged_paper(args.questions, args.questions)
+    documents = {}
+    directory = tempfile.mkdtemp()
+    for number in range(args.uploads):
+        for name, pages in [(f"questions-{number}.pdf", question_pages), (f"answers-{number}.pdf", answer_pages)]:
+            documents[name] = pages
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(make_pdf(len(pages), name))
+    mathpix_server = start_stub_server(FakeMathpixHandler, startup=0, seconds_per_page=args.mathpix_seconds,
+                                       documents=documents)
+    openai_server = start_stub_server(FakeOpenAIHandler, latency=args.gpt_latency)
+    env = dict(
+        os.environ,
+        LOG_LEVEL="WARNING",
+        MATHPIX_API_URL=mathpix_server.base_url + "/v3",
+        MATHPIX_POLL_MIN_INTERVAL="0.1",
+        MATHPIX_POLL_MAX_INTERVAL="0.5",
+        OPENAI_API_BASE=openai_server.base_url + "/v1",
+        OPENAI_API_KEY="sk-stub",
+        GPT_CACHE_ENABLED="0",
+        GPT_REQUESTS_PER_MINUTE="100000000",
+        GPT_TOKENS_PER_MINUTE="100000000000",
+    )
+
+    print(f"{args.uploads} uploads of {args.questions} questions, {args.concurrency} at once, "
+          f"{args.mathpix_seconds}s Mathpix per paper, {args.gpt_latency}s per GPT call")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        run_dir = tempfile.mkdtemp(dir=directory)
+        port = free_port()
+        server = start_server(workers, args.threads, dict(env, CACHE_DIR=os.path.join(run_dir, "cache"),
+                                                          JOBS_DIR=os.path.join(run_dir, "jobs")), port)
+        url = f"http://127.0.0.1:{port}/upload"
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda number: upload(url, directory, number), range(args.uploads)))
+        seconds = time.perf_counter() - start
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=120)
+
+        latencies = [latency for ok, latency in results]
+        failed = sum(not ok for ok, latency in results)
+        print(f"{workers:>2} workers: {args.uploads / seconds:6.2f} uploads/s, "
+              f"p50 {percentile(latencies, 0.5):6.2f}s, p95 {percentile(latencies, 0.95):6.2f}s, "
+              f"{failed} failed, exit code {server.returncode}")
+    mathpix_server.shutdown()
+    openai_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# Local stand-ins for the external services used by the backend, so the
+# benchmarks can run offline with controlled latency.
+import json
+import os
+import re
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+MARKING_SCHEME = "Step 1 (1 mark)"
+
+
+# Canned details for one question of sheet_type: the first allowed value of
+# each constrained field, so every reply passes validation
+def details(sheet_type, keys):
+    from app import sheet_allowed_values, sheet_required_columns
+    allowed_values = sheet_allowed_values[sheet_type]
+    return {
+        key: allowed_values[key][0] if key in allowed_values else "1" if key == "Marks" else MARKING_SCHEME
+        for key in keys or sheet_required_columns[sheet_type]
+    }
+
+
+# Stand-in for app.get_question_details, for benchmarks that skip the HTTP stub
+def details_reply(sheet_type, fields=None):
+    return json.dumps(details(sheet_type, fields))
+
+
+# The sheet a prompt is for, from the keys it asks for or, for repair prompts
+# with only a few keys, the Answer Type choices it lists
+def prompt_sheet_type(prompt, keys):
+    from app import sheet_allowed_values
+    if "Answer Content" in keys:
+        return "Descriptive"
+    if "Answer" in keys:
+        return "Subjective"
+    listed = [sheet_type for sheet_type, allowed_values in sheet_allowed_values.items()
+              if all(option in prompt for option in allowed_values["Answer Type"])]
+    return max(listed, key=lambda sheet_type: len(sheet_allowed_values[sheet_type]["Answer Type"]), default="Objective")
+
+
+# Reply to every prompt style with the keys it asks for: a JSON array for
+# batched prompts, one JSON object for single-question and repair prompts
+def fake_details_reply(payload):
+    prompt = payload["messages"][-1]["content"]
+    keys = json.loads("[" + re.search(r"exactly these keys: (.*)\.\n", prompt).group(1) + "]")
+    sheet_type = prompt_sheet_type(prompt, keys)
+    if "JSON array" not in prompt:
+        return json.dumps(details(sheet_type, keys))
+    fields = [key for key in keys if key != "id"]
+    ids = re.findall(r"^\s*\[(\d+)\] ", prompt, re.MULTILINE)
+    return json.dumps([{"id": int(i), **details(sheet_type, fields)} for i in ids])
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class, **config):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.config = config
+        self.request_count = 0
+        self.connection_count = 0
+        self.payloads = []
+        self.lock = threading.Lock()
+        self.scheme = "http"
+        if config.get("certfile"):
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(config["certfile"], config["keyfile"])
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = "https"
+
+    @property
+    def base_url(self):
+        return f"{self.scheme}://127.0.0.1:{self.server_address[1]}"
+
+    def process_request(self, request, client_address):
+        # Called once per accepted TCP (and TLS) connection
+        with self.lock:
+            self.connection_count += 1
+        super().process_request(request, client_address)
+
+    def count_request(self, payload=None):
+        with self.lock:
+            self.request_count += 1
+            if payload is not None:
+                self.payloads.append(payload)
+            return self.request_count
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs
+    # add ~40 ms to every response on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIHandler(StubHandler):
+    """Answers /v1/chat/completions after a fixed delay with a canned reply."""
+
+    def do_POST(self):
+        payload = self.read_json()
+        self.server.count_request(payload)
+        time.sleep(self.server.config.get("latency", 1.0))
+        reply = self.server.config.get("reply", fake_details_reply)
+        if callable(reply):
+            reply = reply(payload)
+        self.send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+
+class FakeMathpixHandler(StubHandler):
+    """Mimics the Mathpix PDF API.
+
+    An uploaded "PDF" has one page per bytes_per_page bytes of body and
+    converts to the mmd config. The documents config maps file names to the
+    MMD of each page instead. The page_ranges option converts only those
+    pages. A job takes startup +
+    pages * seconds_per_page to finish and reports num_pages and
+    percent_done along the way, like the real status endpoint. With
+    capacity set, at most that many jobs are worked on at once and the rest
+    wait their turn, so chunks of one paper finish one after another.
+    percent_step makes percent_done move in coarse steps of that size.
+    An upload whose file part is empty is rejected, as Mathpix would.
+    """
+
+    def do_POST(self):
+        # Read the upload in chunks so large ones do not sit in the stub's memory;
+        # the options come first in the body
+        remaining = int(self.headers.get("Content-Length") or 0)
+        length = remaining
+        head = b""
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if len(head) < 65536:
+                head += chunk[:65536]
+        number = self.server.count_request()
+        config = self.server.config
+        file_name = re.search(rb'filename="([^"]*)"\r\n(?:[^\r\n]+\r\n)*\r\n', head)
+        boundary = re.search(r"boundary=([^;\s]+)", self.headers.get("Content-Type", ""))
+        # The body ends with the file, then "\r\n--<boundary>--\r\n"
+        if file_name and boundary and length - file_name.end() - len(boundary.group(1)) - 8 <= 0:
+            self.send_json({"error": "Uploaded file is empty", "error_info": {"id": "pdf_empty"}}, status=400)
+            return
+        document = config.get("documents", {}).get(file_name.group(1).decode("utf-8") if file_name else None)
+        if document is not None:
+            page_count = len(document)
+        else:
+            page_count = max(1, length // config.get("bytes_per_page", 1000))
+        pages = list(range(page_count))
+        options = re.search(rb'name="options_json"\r\n\r\n(.*?)\r\n--', head, re.DOTALL)
+        page_range = json.loads(options.group(1)).get("page_ranges") if options else None
+        if page_range:
+            pages = []
+            for part in page_range.split(","):
+                first, _, last = part.partition("-")
+                pages += range(int(first) - 1, min(int(last or first), page_count))
+
+        pdf_id = f"pdf-{number}"
+        duration = config.get("startup", 1.0) + len(pages) * config.get("seconds_per_page", 1.0)
+        now = time.monotonic()
+        with self.server.lock:
+            self.server.jobs = getattr(self.server, "jobs", {})
+            starts_at = now
+            if config.get("capacity"):
+                # Free times of the workers; the job goes to the first one free
+                workers = self.server.workers = getattr(self.server, "workers", [now] * config["capacity"])
+                worker = workers.index(min(workers))
+                starts_at = max(now, workers[worker])
+                workers[worker] = starts_at + duration
+            self.server.jobs[pdf_id] = {"starts_at": starts_at, "pages": pages, "document": document}
+        self.send_json({"pdf_id": pdf_id})
+
+    def do_GET(self):
+        number = self.server.count_request()
+        # error_every=n answers every n-th request with a 503, like a flaky gateway
+        error_every = self.server.config.get("error_every")
+        if error_every and number % error_every == 0:
+            self.send_json({"error": "service unavailable"}, status=503)
+            return
+        match = re.match(r"^/v3/pdf/([^/.]+)\.(json|mmd)$", self.path)
+        job = getattr(self.server, "jobs", {}).get(match.group(1)) if match else None
+        if not job:
+            self.send_json({"error": "not found"}, status=404)
+            return
+
+        config = self.server.config
+        startup = config.get("startup", 1.0)
+        total = startup + len(job["pages"]) * config.get("seconds_per_page", 1.0)
+        elapsed = time.monotonic() - job["starts_at"]
+
+        if match.group(2) == "mmd":
+            if job["document"] is not None:
+                text = "\n".join(job["document"][page] for page in job["pages"])
+            else:
+                text = config.get("mmd", "1. What is 2 + 2?\n(a) 3\n(b) 4\n(c) 5\n(d) 6\n")
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif elapsed >= total:
+            self.send_json({"status": "completed", "num_pages": len(job["pages"]), "percent_done": 100})
+        elif elapsed < startup:
+            self.send_json({"status": "received"})
+        else:
+            percent = 100 * (elapsed - startup) / (total - startup)
+            step = config.get("percent_step")
+            self.send_json({
+                "status": "split",
+                "num_pages": len(job["pages"]),
+                "percent_done": step * (percent // step) if step else round(percent, 1),
+            })
+
+
+# Pages of an MMD file in fixtures/ as Mathpix returned it, split at form feeds,
+# for the documents config of FakeMathpixHandler
+def load_mmd_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read().split("\f")
+
+
+# Self-signed certificate for 127.0.0.1, for stubs started with certfile/keyfile.
+# Point REQUESTS_CA_BUNDLE at the certificate so clients trust it.
+def make_self_signed_cert(directory):
+    certfile = os.path.join(directory, "stub-cert.pem")
+    keyfile = os.path.join(directory, "stub-key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True
+    )
+    return certfile, keyfile
+
+
+def start_stub_server(handler_class, **config):
+    server = StubServer(handler_class, **config)
+    if handler_class is FakeOpenAIHandler and "reply" not in config:
+        # The canned replies read the allowed values from app; import it now so
+        # the first requests do not all wait on the import. Settings app reads
+        # from the environment must be set before this.
+        import app
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Point the openai module at a running fake OpenAI server
+def use_fake_openai(server):
+    import openai
+    openai.api_key = "sk-stub"
+    openai.api_base = server.base_url + "/v1"
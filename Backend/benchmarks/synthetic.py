@@ -0,0 +1,80 @@
+# Synthetic question papers and answer keys in the cleaned Mathpix text format
+import random
+
+
+def objective_question(number, rng):
+    options = [rng.randint(1, 99) for _ in range(4)]
+    return "\n".join([
+        f"{number}. What is {rng.randint(1, 50)} + {rng.randint(1, 50)}?",
+        *(f"{letter}) {value}" for letter, value in zip("abcd", options)),
+    ])
+
+
+def blank_question(number, rng):
+    word = rng.choice(["photosynthesis", "evaporation", "gravity", "friction"])
+    return f"{number}. The process called ______ is explained by {word} in chapter {rng.randint(1, 20)}. (1)"
+
+
+def descriptive_question(number, rng):
+    topic = rng.choice(["the water cycle", "Newton's laws", "the French revolution", "linear equations"])
+    return "\n".join([
+        f"{number}. Explain {topic} in detail. (5)",
+        f"Use examples from chapter {rng.randint(1, 20)} to support your answer.",
+    ])
+
+
+def solution(number, kind, rng):
+    if kind == "objective":
+        return f"{number}. ({rng.choice('abcd')}) is correct because the sum matches."
+    if kind == "blank":
+        return f"{number}. The blank is filled with the correct term."
+    return "\n".join([
+        f"{number}. Step 1: state the definition (2 marks).",
+        "Step 2: give an example (2 marks).",
+        "Step 3: conclude (1 mark).",
+    ])
+
+
+# Returns (question paper text, answer key text) with questions of each kind in turn
+def make_paper(count, kinds=("objective", "blank", "descriptive"), seed=0):
+    rng = random.Random(seed)
+    builders = {"objective": objective_question, "blank": blank_question, "descriptive": descriptive_question}
+    questions = []
+    solutions = []
+    for number in range(1, count + 1):
+        kind = kinds[(number - 1) % len(kinds)]
+        questions.append(builders[kind](number, rng))
+        solutions.append(solution(number, kind, rng))
+    return "\n\n".join(questions) + "\n", "\n\n".join(solutions) + "\n"
+
+
+def write_paper(directory, count, **kwargs):
+    import os
+    question_text, solution_text = make_paper(count, **kwargs)
+    question_path = os.path.join(directory, "questions.txt")
+    solution_path = os.path.join(directory, "solutions.txt")
+    with open(question_path, "w", encoding="utf-8") as f:
+        f.write(question_text)
+    with open(solution_path, "w", encoding="utf-8") as f:
+        f.write(solution_text)
+    return question_path, solution_path
+
+
+# Returns (question pages, answer key pages), the MMD of each page, with
+# questions_per_page questions on each
+def make_paged_paper(count, questions_per_page, **kwargs):
+    question_text, solution_text = make_paper(count, **kwargs)
+    pages = []
+    for text in (question_text, solution_text):
+        blocks = text.strip().split("\n\n")
+        pages.append(["\n\n".join(blocks[i:i + questions_per_page]) + "\n"
+                      for i in range(0, len(blocks), questions_per_page)])
+    return pages[0], pages[1]
+
+
+# Bytes that pass for a PDF with page_count pages, as far as counting pages
+# goes. The name is written into a comment so different papers hash differently.
+def make_pdf(page_count, name=""):
+    objects = "".join(f"{number} 0 obj\n<< /Type /Page /Parent 1 0 R >>\nendobj\n"
+                      for number in range(2, page_count + 2))
+    return f"%PDF-1.4\n% {name}\n1 0 obj\n<< /Type /Pages /Count {page_count} >>\nendobj\n{objects}%%EOF\n".encode("ascii")
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+
+# Mathpix cache settings
+MATHPIX_CACHE_ENABLED = os.getenv("MATHPIX_CACHE_ENABLED", "1") != "0"
+MATHPIX_CACHE_MAX_BYTES = int(os.getenv("MATHPIX_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+MATHPIX_CACHE_MAX_AGE = int(os.getenv("MATHPIX_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+
+# Hash a file-like object in chunks and rewind it so it can still be uploaded
+def hash_stream(stream, extra=b"", chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    digest.update(extra)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class MathpixCache:
+    """Cleaned MMD text on disk, keyed by the SHA-256 of the PDF bytes plus
+    the Mathpix options.
+
+    Entries are plain files; the modification time is refreshed on every hit
+    so eviction can drop the least recently used ones first once the cache
+    grows past max_bytes. Entries older than max_age are dropped as well.
+    """
+
+    def __init__(self, directory=os.path.join(CACHE_DIR, "mathpix"), max_bytes=MATHPIX_CACHE_MAX_BYTES,
+                 max_age=MATHPIX_CACHE_MAX_AGE, enabled=MATHPIX_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, stream, options):
+        return hash_stream(stream, json.dumps(options, sort_keys=True).encode("utf-8"))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mmd")
+
+    def _lookup(self, key):
+        # Path of a live entry, refreshed for LRU, or None; counts the hit or miss
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._lookup(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except (TypeError, OSError):
+            return None
+
+    def copy_to(self, key, dest_path):
+        # Copy an entry to dest_path without reading it into memory; False on a miss
+        if not self.enabled:
+            return False
+        path = self._lookup(key)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, dest_path)
+        except OSError:
+            return False
+        return True
+
+    def put(self, key, content):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temp file first so concurrent readers never see half an entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(temp_path, self._path(key))
+        self.evict()
+
+    def put_file(self, key, source_path):
+        # Like put, for MMD that is already in a file
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".mmd"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+mathpix_cache = MathpixCache()
+
+
+# GPT details cache settings
+GPT_CACHE_ENABLED = os.getenv("GPT_CACHE_ENABLED", "1") != "0"
+GPT_CACHE_MAX_ENTRIES = int(os.getenv("GPT_CACHE_MAX_ENTRIES", "100000"))
+GPT_CACHE_TTL = int(os.getenv("GPT_CACHE_TTL", str(90 * 24 * 3600)))
+
+
+class GPTCache:
+    """Parsed GPT question details in SQLite, shared by all worker processes.
+
+    Keys combine the sheet type, prompt template version, model name and a
+    hash of the whitespace-normalized question text. Entries expire after
+    ttl seconds and the least recently used ones are dropped once there are
+    more than max_entries.
+    """
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "gpt.sqlite3"), max_entries=GPT_CACHE_MAX_ENTRIES,
+                 ttl=GPT_CACHE_TTL, enabled=GPT_CACHE_ENABLED):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_details ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS gpt_details_accessed ON gpt_details (accessed_at)")
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(sheet_type, prompt_version, model, question_content):
+        normalized = " ".join(question_content.split())
+        question_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{sheet_type}:{prompt_version}:{model}:{question_hash}"
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            row = connection.execute(
+                "SELECT value FROM gpt_details WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                connection.execute("UPDATE gpt_details SET accessed_at = ? WHERE key = ?", (now, key))
+        with self.lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO gpt_details (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+        with self.lock:
+            self.puts += 1
+            evict = self.puts % 100 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM gpt_details WHERE created_at <= ?", (time.time() - self.ttl,))
+            connection.execute(
+                "DELETE FROM gpt_details WHERE key IN ("
+                "SELECT key FROM gpt_details ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+gpt_cache = GPTCache()
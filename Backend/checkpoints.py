@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import threading
+
+
+class CheckpointJournal:
+    """Append-only JSON lines file of GPT results per row, so a job that is
+    restarted only sends the questions it has not done yet.
+
+    Each line holds the sheet, row index, a hash of the question text and
+    either the parsed details or the error. Later lines win, so retrying a
+    row just appends another line. A row is only reused while the hash still
+    matches its question.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may have been cut short by a crash
+                        continue
+                    self.entries[(entry["sheet"], entry["row"])] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def question_hash(question):
+        return hashlib.sha256(question.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_failed(entry):
+        # Errored rows and rows that came back with empty fields
+        details = entry["details"]
+        return bool(entry["error"]) or not details or any(value is None or not str(value).strip() for value in details)
+
+    def get(self, sheet, row, question):
+        entry = self.entries.get((sheet, int(row)))
+        if entry and entry["hash"] == self.question_hash(question):
+            return entry
+        return None
+
+    def record(self, sheet, row, question, details=None, error=None):
+        entry = {
+            "sheet": sheet,
+            "row": int(row),
+            "hash": self.question_hash(question),
+            "details": details,
+            "error": str(error) if error else None,
+        }
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.entries[(sheet, int(row))] = entry
+            self.file.write(line)
+            self.file.flush()
+
+    def failed_rows(self):
+        with self.lock:
+            return sorted(key for key, entry in self.entries.items() if self.is_failed(entry))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,141 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Concurrency and rate limit settings for GPT calls
+GPT_MAX_WORKERS = int(os.getenv("GPT_MAX_WORKERS", "8"))
+GPT_REQUESTS_PER_MINUTE = int(os.getenv("GPT_REQUESTS_PER_MINUTE", "200"))
+GPT_TOKENS_PER_MINUTE = int(os.getenv("GPT_TOKENS_PER_MINUTE", "40000"))
+GPT_MAX_RETRIES = int(os.getenv("GPT_MAX_RETRIES", "5"))
+# Upper bound on GPT calls in flight across every pool in the process
+GPT_MAX_CONCURRENT = int(os.getenv("GPT_MAX_CONCURRENT", "16"))
+
+gpt_slots = threading.BoundedSemaphore(GPT_MAX_CONCURRENT)
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute.
+
+    A single limiter is shared by every worker thread so the budgets hold for
+    the whole process, not per worker.
+    """
+
+    def __init__(self, requests_per_minute=GPT_REQUESTS_PER_MINUTE, tokens_per_minute=GPT_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_budget = float(requests_per_minute)
+        self.token_budget = float(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.request_budget = min(self.requests_per_minute,
+                                  self.request_budget + elapsed * self.requests_per_minute / 60.0)
+        self.token_budget = min(self.tokens_per_minute,
+                                self.token_budget + elapsed * self.tokens_per_minute / 60.0)
+
+    def acquire(self, tokens=0):
+        # A single call larger than the whole budget can never fit, so cap it
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    missing_requests = 1 - self.request_budget
+                    missing_tokens = tokens - self.token_budget
+                    if missing_requests <= 0 and missing_tokens <= 0:
+                        self.request_budget -= 1
+                        self.token_budget -= tokens
+                        return
+                    wait = max(missing_requests * 60.0 / self.requests_per_minute,
+                               missing_tokens * 60.0 / self.tokens_per_minute)
+            time.sleep(wait)
+
+    def share(self, processes):
+        # Each of several processes on the same API key keeps to its part of the budgets
+        with self.lock:
+            self.requests_per_minute /= processes
+            self.tokens_per_minute /= processes
+            self.request_budget = min(self.request_budget, self.requests_per_minute)
+            self.token_budget = min(self.token_budget, self.tokens_per_minute)
+
+    def pause(self, seconds):
+        # Called after a 429 so every worker backs off, not just the one that hit it
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# Budgets are per API key, so by default every job in the process shares one limiter
+default_limiter = RateLimiter()
+
+
+def get_retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_backoff(fetch, payload, limiter, tokens=0, max_retries=GPT_MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        with metrics.timer("gpt.rate_limit_wait"):
+            limiter.acquire(tokens)
+        try:
+            with gpt_slots, metrics.timer("gpt.call"):
+                return fetch(payload)
+        except (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                openai.error.APIConnectionError, openai.error.Timeout) as e:
+            if attempt == max_retries:
+                metrics.increment("gpt.errors")
+                raise
+            delay = get_retry_after(e) or min(60.0, 2 ** attempt) * (1 + random.random())
+            logger.warning(f"GPT call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            metrics.increment("gpt.retries")
+            limiter.pause(delay)
+        except Exception:
+            metrics.increment("gpt.errors")
+            raise
+
+
+# Run fetch(payload) for every (key, payload) item on a bounded thread pool.
+# Returns two dicts keyed by the item key: results and errors. Keys let the
+# caller write results back to the right rows whatever order they finish in.
+# on_done, if given, is called on this thread with (key, result, error) as
+# each item finishes, e.g. to checkpoint it before the rest are done.
+def enrich_rows(items, fetch, max_workers=GPT_MAX_WORKERS, limiter=None, estimate_tokens=None, on_done=None):
+    limiter = limiter or default_limiter
+    results = {}
+    errors = {}
+    if not items:
+        return results, errors
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        futures = {}
+        for key, payload in items:
+            tokens = estimate_tokens(payload) if estimate_tokens else 0
+            futures[metrics.submit(executor, call_with_backoff, fetch, payload, limiter, tokens)] = key
+
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+            if on_done:
+                on_done(key, results.get(key), errors.get(key))
+    return results, errors
@@ -0,0 +1,48 @@
+import math
+
+import pandas as pd
+from openpyxl import Workbook
+
+
+def _cell_value(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+class StreamingExcelWriter:
+    """Writes sheets row by row through a write-only openpyxl workbook, so
+    memory stays flat however many rows go through it.
+
+    The header of each sheet is taken from the columns of the first
+    non-empty frame written to it; later frames are written in that column
+    order. Sheets that never receive rows get the header passed to close().
+    """
+
+    def __init__(self, path, sheet_names):
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {sheet_name: self.workbook.create_sheet(sheet_name) for sheet_name in sheet_names}
+        self.columns = {}
+        self.rows_written = {sheet_name: 0 for sheet_name in sheet_names}
+
+    def write_frame(self, sheet_name, df):
+        if df.empty:
+            return
+        sheet = self.sheets[sheet_name]
+        if sheet_name not in self.columns:
+            self.columns[sheet_name] = list(df.columns)
+            sheet.append(self.columns[sheet_name])
+        for row in df.reindex(columns=self.columns[sheet_name]).itertuples(index=False, name=None):
+            sheet.append([_cell_value(value) for value in row])
+        self.rows_written[sheet_name] += len(df)
+
+    def write_frames(self, frames):
+        for sheet_name, df in frames.items():
+            self.write_frame(sheet_name, df)
+
+    def close(self, empty_sheet_columns=None):
+        for sheet_name, sheet in self.sheets.items():
+            if sheet_name not in self.columns and empty_sheet_columns and sheet_name in empty_sheet_columns:
+                sheet.append(empty_sheet_columns[sheet_name])
+        self.workbook.save(self.path)
@@ -0,0 +1,39 @@
+# Production server settings, read by gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Workers share the Mathpix and GPT caches and the job queue through files
+# and SQLite under CACHE_DIR and JOBS_DIR. MATHPIX_MAX_CONCURRENT,
+# GPT_MAX_CONCURRENT and JOB_WORKERS are per worker; the GPT rate limits are
+# split between workers. /metrics reports the worker that answered.
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv("WEB_WORKERS", str(min(4, multiprocessing.cpu_count()))))
+# Threaded workers keep answering /jobs polls while an /upload runs for minutes
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+# Import pandas, openai and the app once in the master instead of per worker
+preload_app = True
+# Seconds a stopping worker gets for in-flight requests and running jobs
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "90"))
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+
+
+def post_fork(server, worker):
+    from enrichment import default_limiter
+    default_limiter.share(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    # Pick up queued jobs straight away, including ones a stopped worker gave back
+    from app import job_runner
+    job_runner.start()
+
+
+def worker_exit(server, worker):
+    # Requests are done by now; leave a few seconds before the master kills the worker
+    from app import job_runner
+    if job_runner.drain(max(graceful_timeout - 10, 0)):
+        # The threads of jobs given back to the queue must not go on to mark
+        # them finished or failed, so do not wait for them
+        os._exit(0)
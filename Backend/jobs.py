@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "50"))
+# Running jobs are touched every JOB_HEARTBEAT_SECONDS. A running job not
+# touched for JOB_STALE_SECONDS lost its worker and is queued again.
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+# On shutdown, running jobs get this long to finish before they are queued again
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "60"))
+# Finished jobs and their files are deleted this long after they finished; 0 keeps them
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """Jobs and their progress in SQLite. The jobs table doubles as the queue:
+    workers claim the oldest queued job inside a write transaction, so several
+    threads or processes can pull from it safely.
+    """
+
+    def __init__(self, directory=JOBS_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT NOT NULL, percent REAL NOT NULL, "
+                "params TEXT NOT NULL, result_path TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "metrics TEXT)"
+            )
+            # Job stores created before the metrics column existed
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "metrics" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN metrics TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self.local.connection = connection
+        return connection
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def new_job_id(self):
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        return job_id
+
+    def enqueue(self, job_id, params, max_queued=JOB_MAX_QUEUED):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            queued = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= max_queued:
+                raise QueueFull(f"{queued} jobs already waiting")
+            connection.execute(
+                "INSERT INTO jobs (id, status, stage, percent, params, created_at, updated_at) "
+                "VALUES (?, 'queued', 'queued', 0, ?, ?, ?)",
+                (job_id, json.dumps(params), now, now)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def claim(self, stale_after=JOB_STALE_SECONDS):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker died mid-run go back to the front of the queue
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued' WHERE status = 'running' AND updated_at < ?",
+                (time.time() - stale_after,)
+            )
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', stage = 'starting', updated_at = ? WHERE id = ?",
+                    (time.time(), row["id"])
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return dict(row) if row else None
+
+    def purge(self, older_than=JOB_RETENTION_SECONDS):
+        # Delete completed and failed jobs not touched for older_than seconds,
+        # with their uploads, results and checkpoints
+        if not older_than:
+            return 0
+        connection = self._connection()
+        cutoff = time.time() - older_than
+        rows = connection.execute(
+            "SELECT id FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?", (cutoff,)
+        ).fetchall()
+        purged = 0
+        for row in rows:
+            # A job retried in the meantime is no longer finished and is kept
+            deleted = connection.execute(
+                "DELETE FROM jobs WHERE id = ? AND status IN ('completed', 'failed') AND updated_at < ?",
+                (row["id"], cutoff)
+            ).rowcount
+            if deleted:
+                shutil.rmtree(self.job_dir(row["id"]), ignore_errors=True)
+                purged += 1
+        if purged:
+            metrics.increment("jobs.purged", purged)
+            logger.info(f"Deleted {purged} finished jobs older than {older_than:.0f}s")
+        return purged
+
+    def requeue(self, job_id, params):
+        self.update(job_id, status="queued", stage="queued", percent=0, params=json.dumps(params),
+                    result_path=None, error=None, metrics=None)
+
+    def release(self, job_id):
+        # Give a running job back to the queue; it resumes from its checkpoints
+        self._connection().execute(
+            "UPDATE jobs SET status = 'queued', stage = 'queued', updated_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        )
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+
+class JobRunner:
+    """Bounded pool of background threads that run queued jobs.
+
+    handler(job, progress) does the work and returns the result path;
+    progress(stage, percent) records how far it got. Stage timings and
+    counters recorded while it runs are saved with the job.
+    """
+
+    def __init__(self, store, handler, workers=JOB_WORKERS):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.threads = []
+        self.running = set()
+        self.heartbeat_thread = None
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Threads are started lazily so forked server workers each get their own
+        with self.lock:
+            if self.stopping.is_set():
+                return
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-worker-{len(self.threads)}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            if self.heartbeat_thread is None or not self.heartbeat_thread.is_alive():
+                self.heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+                self.heartbeat_thread.start()
+
+    def submit(self, job_id, params):
+        self.store.enqueue(job_id, params)
+        self.start()
+        self.wakeup.set()
+
+    def resubmit(self, job_id, params):
+        self.store.requeue(job_id, params)
+        self.start()
+        self.wakeup.set()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self.lock:
+                running = list(self.running)
+            for job_id in running:
+                self.store.update(job_id)
+            try:
+                self.store.purge()
+            except Exception:
+                logger.exception("Deleting old jobs failed")
+
+    def drain(self, timeout=JOB_DRAIN_SECONDS):
+        # Stop claiming jobs and wait for the running ones. Jobs still running
+        # after timeout are queued again for another process to pick up.
+        self.stopping.set()
+        self.wakeup.set()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if not self.running:
+                    return []
+            time.sleep(0.1)
+        with self.lock:
+            running = list(self.running)
+        for job_id in running:
+            self.store.release(job_id)
+        logger.warning(f"Queued {len(running)} unfinished jobs again: {', '.join(running)}")
+        return running
+
+    def _work(self):
+        while not self.stopping.is_set():
+            job = self.store.claim()
+            if job is not None and self.stopping.is_set():
+                self.store.release(job["id"])
+                break
+            if job is None:
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+                continue
+            self.run(job)
+
+    def run(self, job):
+        job_id = job["id"]
+        job["params"] = json.loads(job["params"])
+
+        def progress(stage, percent):
+            self.store.update(job_id, stage=stage, percent=round(percent, 1))
+
+        with self.lock:
+            self.running.add(job_id)
+        with metrics.collect() as job_metrics:
+            try:
+                with metrics.timer("job"):
+                    result_path = self.handler(job, progress)
+                self.store.update(job_id, status="completed", stage="completed", percent=100, result_path=result_path,
+                                  metrics=json.dumps(job_metrics.snapshot()))
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed")
+                self.store.update(job_id, status="failed", stage="failed", error=str(e),
+                                  metrics=json.dumps(job_metrics.snapshot()))
+            finally:
+                with self.lock:
+                    self.running.discard(job_id)
+        logger.info(f"Job {job_id} timings:\n{job_metrics.summary()}")
@@ -0,0 +1,455 @@
+import heapq
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MATHPIX_API_URL = os.getenv("MATHPIX_API_URL", "https://api.mathpix.com/v3")
+MATHPIX_API_KEY = os.getenv("MATHPIX_API_KEY")
+MATHPIX_APP_ID = os.getenv("MATHPIX_APP_ID")
+
+# HTTP settings. Timeouts are in seconds; uploads get longer for big PDFs.
+MATHPIX_TIMEOUT = float(os.getenv("MATHPIX_TIMEOUT", "30"))
+MATHPIX_UPLOAD_TIMEOUT = float(os.getenv("MATHPIX_UPLOAD_TIMEOUT", "300"))
+# Status polls are not retried and time out sooner: the poller polls again
+# anyway, and one slow poll holds up the polls of every other PDF
+MATHPIX_STATUS_TIMEOUT = float(os.getenv("MATHPIX_STATUS_TIMEOUT", "5"))
+MATHPIX_HTTP_RETRIES = int(os.getenv("MATHPIX_HTTP_RETRIES", "3"))
+MATHPIX_POOL_SIZE = int(os.getenv("MATHPIX_POOL_SIZE", "16"))
+
+# Uploads that cannot seek are copied to a temp file, kept in memory up to
+# this many bytes. MMD downloads are read in chunks of this many bytes.
+MATHPIX_SPOOL_MAX_MEMORY = int(os.getenv("MATHPIX_SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+MATHPIX_DOWNLOAD_CHUNK_SIZE = int(os.getenv("MATHPIX_DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Adaptive polling settings, in seconds. The base deadline, used while the
+# page count is unknown, is no shorter than the old 10 polls 13 s apart.
+MATHPIX_POLL_MIN_INTERVAL = float(os.getenv("MATHPIX_POLL_MIN_INTERVAL", "1"))
+MATHPIX_POLL_MAX_INTERVAL = float(os.getenv("MATHPIX_POLL_MAX_INTERVAL", "15"))
+MATHPIX_BASE_DEADLINE = float(os.getenv("MATHPIX_BASE_DEADLINE", "130"))
+MATHPIX_DEADLINE_PER_PAGE = float(os.getenv("MATHPIX_DEADLINE_PER_PAGE", "10"))
+MATHPIX_MAX_DEADLINE = float(os.getenv("MATHPIX_MAX_DEADLINE", "1800"))
+
+# Upper bound on PDFs being converted at once across the process
+MATHPIX_MAX_CONCURRENT = int(os.getenv("MATHPIX_MAX_CONCURRENT", "8"))
+mathpix_slots = threading.BoundedSemaphore(MATHPIX_MAX_CONCURRENT)
+
+# Long PDFs are converted in chunks of this many pages at the same time, so
+# parsing and GPT can start on the first pages while the rest are in OCR.
+# 0 converts every PDF in one piece.
+MATHPIX_PAGES_PER_CHUNK = int(os.getenv("MATHPIX_PAGES_PER_CHUNK", "0"))
+
+# Page objects in the PDF body, e.g. "/Type /Page" but not "/Type /Pages"
+PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+
+class MathpixError(RuntimeError):
+    pass
+
+
+# Return a stream that can seek, copying it into a spooled temp file if needed
+def seekable_stream(stream):
+    seekable = getattr(stream, "seekable", None)
+    if seekable is not None and seekable():
+        return stream
+    spooled = tempfile.SpooledTemporaryFile(max_size=MATHPIX_SPOOL_MAX_MEMORY)
+    shutil.copyfileobj(stream, spooled, 1024 * 1024)
+    spooled.seek(0)
+    return spooled
+
+
+# Estimate the page count of a PDF from its page objects, reading it in
+# chunks and rewinding it. Returns None when no page objects are visible,
+# e.g. when they are inside compressed object streams.
+def count_pdf_pages(stream, chunk_size=1024 * 1024):
+    count = 0
+    tail = b""
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        data = tail + chunk
+        # Matches in the kept tail were counted with the previous chunk
+        count += sum(1 for match in PDF_PAGE_PATTERN.finditer(data) if match.end() > len(tail))
+        tail = data[-64:]
+    stream.seek(0)
+    return count or None
+
+
+# Mathpix page_ranges values covering page_count pages, pages_per_chunk at a time
+def page_ranges(page_count, pages_per_chunk):
+    return [f"{first}-{min(first + pages_per_chunk - 1, page_count)}"
+            for first in range(1, page_count + 1, pages_per_chunk)]
+
+
+# Number of pages in a page_ranges value such as "1-4" or "1-2,5"
+def page_range_count(value):
+    count = 0
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        count += int(last or first) - int(first) + 1
+    return count
+
+
+class MultipartStream:
+    """multipart/form-data body that reads the file as it is sent, instead
+    of building the whole body in memory as requests does for files=.
+
+    It has a length, so requests sends Content-Length rather than chunked
+    encoding, and tell()/seek() so urllib3 can rewind it for a retry.
+    """
+
+    def __init__(self, fields, file_field, file_name, stream, content_type):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        file_name = file_name.replace('"', "%22")
+        self.head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        ).encode("utf-8") + (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode("utf-8")
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.stream = stream
+        self.file_start = stream.tell()
+        self.file_size = stream.seek(0, os.SEEK_END) - self.file_start
+        self.length = len(self.head) + self.file_size + len(self.tail)
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(lambda: self.read(1024 * 1024), b"")
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self.position = offset
+        self.stream.seek(self.file_start + min(max(offset - len(self.head), 0), self.file_size))
+        return offset
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+        file_end = len(self.head) + self.file_size
+        chunks = []
+        while size > 0 and self.position < self.length:
+            if self.position < len(self.head):
+                chunk = self.head[self.position:self.position + size]
+            elif self.position < file_end:
+                chunk = self.stream.read(min(size, file_end - self.position))
+                if not chunk:
+                    raise IOError("Upload file is shorter than when the request started")
+            else:
+                offset = self.position - file_end
+                chunk = self.tail[offset:offset + size]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+
+class StreamingReplacer:
+    """Applies str.replace for each (old, new) pair, in order, to text that
+    arrives in chunks, with the same result as replacing in the whole text.
+
+    Each step holds back the last few characters of a chunk when they could
+    be the start of a match that continues in the next chunk.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = list(replacements)
+        self.carries = [""] * len(self.replacements)
+
+    def _replace(self, step, text):
+        old, new = self.replacements[step]
+        if len(old) == 1:
+            return text.replace(old, new)
+        text = self.carries[step] + text
+        parts = []
+        start = 0
+        while True:
+            found = text.find(old, start)
+            if found == -1:
+                break
+            parts.append(text[start:found])
+            parts.append(new)
+            start = found + len(old)
+        hold = max(start, len(text) - len(old) + 1)
+        parts.append(text[start:hold])
+        self.carries[step] = text[hold:]
+        return "".join(parts)
+
+    def feed(self, text):
+        for step in range(len(self.replacements)):
+            text = self._replace(step, text)
+        return text
+
+    def flush(self):
+        # The held back characters are too short to match, so they pass through
+        text = ""
+        for step in range(len(self.replacements)):
+            text = self._replace(step, text) + self.carries[step]
+            self.carries[step] = ""
+        return text
+
+
+class PagedText:
+    """Lines of a PDF converted in page chunks, read in page order.
+
+    chunks are futures of the MMD file paths of each chunk, in page order;
+    a chunk that failed has None as its result. Iterating blocks until the
+    next chunk is done. ready() tells whether the next line can be read
+    without waiting, so readers can hand on what they have first.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chunks_read = 0
+        self.lines = []
+
+    def ready(self):
+        return bool(self.lines) or self.chunks_read == len(self.chunks) or self.chunks[self.chunks_read].done()
+
+    def fraction_read(self):
+        return self.chunks_read / len(self.chunks)
+
+    def paths(self):
+        # Waits for every chunk
+        paths = [chunk.result() for chunk in self.chunks]
+        if None in paths:
+            raise MathpixError("Failed to process files with Mathpix")
+        return paths
+
+    def __iter__(self):
+        while self.chunks_read < len(self.chunks):
+            chunk = self.chunks[self.chunks_read]
+            if not chunk.done():
+                with metrics.timer("mathpix.pipeline_wait"):
+                    chunk.result()
+            if chunk.result() is None:
+                raise MathpixError("Failed to process files with Mathpix")
+            with open(chunk.result(), "r", encoding="utf-8", newline="") as f:
+                self.lines = f.readlines()
+            self.chunks_read += 1
+            # Reversed so lines can be popped from the end
+            self.lines.reverse()
+            while self.lines:
+                yield self.lines.pop()
+
+    def join(self, dest_path):
+        # Write the whole text to dest_path; each chunk ends on its own line
+        with open(dest_path, "w", encoding="utf-8", newline="") as dest:
+            for path in self.paths():
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    text = f.read()
+                dest.write(text if not text or text.endswith("\n") else text + "\n")
+
+    def remove(self):
+        for chunk in self.chunks:
+            if chunk.done() and not chunk.cancelled() and chunk.exception() is None and chunk.result():
+                try:
+                    os.remove(chunk.result())
+                except OSError:
+                    pass
+
+
+class MathpixClient:
+    """Mathpix PDF API calls over one pooled requests.Session.
+
+    Connections are kept alive and reused across uploads, polls and
+    downloads. Connection errors are retried with backoff for every call;
+    500/502/503/504 replies and read errors only for GETs, as a repeated
+    upload could start a second, billed conversion. Every call has a
+    timeout. Status polls go through a second session without retries. The
+    sessions are configured once and only used to send requests afterwards,
+    so one client can be shared by all worker threads.
+    """
+
+    def __init__(self, base_url=MATHPIX_API_URL, app_id=MATHPIX_APP_ID, app_key=MATHPIX_API_KEY,
+                 timeout=MATHPIX_TIMEOUT, upload_timeout=MATHPIX_UPLOAD_TIMEOUT, status_timeout=MATHPIX_STATUS_TIMEOUT,
+                 retries=MATHPIX_HTTP_RETRIES, pool_size=MATHPIX_POOL_SIZE):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+        self.status_timeout = status_timeout
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset({"GET"}), raise_on_status=False)
+        self.session = self._session(app_id, app_key, retry, pool_size)
+        self.status_session = self._session(app_id, app_key, 0, pool_size)
+
+    def _session(self, app_id, app_key, retry, pool_size):
+        session = requests.Session()
+        session.headers.update({"app_id": app_id or "", "app_key": app_key or ""})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def upload_pdf(self, file_name, stream, content_type, options):
+        # stream must be able to seek; see seekable_stream
+        body = MultipartStream({"options_json": json.dumps(options)}, "file", file_name, stream, content_type)
+        response = self.session.post(
+            f"{self.base_url}/pdf",
+            data=body,
+            headers={"Content-Type": body.content_type},
+            timeout=self.upload_timeout,
+        )
+        return response.json()
+
+    def get_status(self, pdf_id):
+        response = self.status_session.get(f"{self.base_url}/pdf/{pdf_id}.json", timeout=self.status_timeout)
+        return response.json()
+
+    def stream_mmd(self, pdf_id, chunk_size=MATHPIX_DOWNLOAD_CHUNK_SIZE):
+        # Yields the MMD text in decoded chunks as it arrives
+        with self.session.get(f"{self.base_url}/pdf/{pdf_id}.mmd", timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            if response.encoding is None:
+                response.encoding = "utf-8"
+            yield from response.iter_content(chunk_size, decode_unicode=True)
+
+
+client = MathpixClient()
+
+
+class PollJob:
+    def __init__(self, pdf_id, poller, pages=None):
+        self.pdf_id = pdf_id
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + poller.deadline(pages)
+        self.interval = poller.min_interval
+        self.polls = 0
+        self.first_progress = None
+        self.result = None
+        self.done = threading.Event()
+
+
+class MathpixPoller:
+    """Polls the status of every pending Mathpix PDF from one background loop.
+
+    Each PDF starts with short intervals that back off exponentially with
+    jitter. Once Mathpix reports percent_done the next poll is scheduled
+    around the estimated completion time instead. The deadline grows with
+    the page count given to wait(), then with num_pages once Mathpix reports
+    it, rather than being a fixed number of polls.
+    """
+
+    def __init__(self, get_status=client.get_status, min_interval=MATHPIX_POLL_MIN_INTERVAL,
+                 max_interval=MATHPIX_POLL_MAX_INTERVAL, base_deadline=MATHPIX_BASE_DEADLINE,
+                 deadline_per_page=MATHPIX_DEADLINE_PER_PAGE, max_deadline=MATHPIX_MAX_DEADLINE):
+        self.get_status = get_status
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.base_deadline = base_deadline
+        self.deadline_per_page = deadline_per_page
+        self.max_deadline = max_deadline
+        self.schedule = []
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def deadline(self, pages):
+        # Seconds from submission until a PDF of that many pages is given up on
+        if not pages:
+            return self.base_deadline
+        return min(self.max_deadline, self.base_deadline + self.deadline_per_page * pages)
+
+    def wait(self, pdf_id, pages=None):
+        # Blocks the calling thread until the PDF completes, fails or runs out
+        # of time. pages, if known, sets the deadline before Mathpix reports it.
+        job = PollJob(pdf_id, self, pages)
+        with self.condition:
+            heapq.heappush(self.schedule, (job.started_at + self._jitter(self.min_interval), id(job), job))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="mathpix-poller", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        # Every job is given up on by max_deadline; the slack covers the last
+        # poll. Should the polling thread die, callers still get an answer.
+        if not job.done.wait(max(self.base_deadline, self.max_deadline) + self.max_interval + 60):
+            logger.error(f"No answer from the poller for PDF ID {pdf_id}; giving up")
+        return job.result
+
+    def _jitter(self, interval):
+        return interval * random.uniform(0.8, 1.2)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.schedule:
+                    self.condition.wait()
+                due_at, _, job = self.schedule[0]
+                delay = due_at - time.monotonic()
+                if delay > 0:
+                    # Wake up early if a new PDF is registered in the meantime
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.schedule)
+
+            next_poll = self._poll(job)
+            if next_poll is None:
+                job.done.set()
+            else:
+                with self.condition:
+                    heapq.heappush(self.schedule, (next_poll, id(job), job))
+
+    def _poll(self, job):
+        job.polls += 1
+        metrics.increment("mathpix.status_requests")
+        try:
+            status_data = self.get_status(job.pdf_id)
+        except Exception as e:
+            logger.warning(f"Polling attempt {job.polls} for PDF ID {job.pdf_id} failed: {e}")
+            status_data = {}
+        now = time.monotonic()
+        logger.debug(f"Polling attempt {job.polls} for PDF ID {job.pdf_id}: {status_data}")
+
+        status = status_data.get("status")
+        if status == "completed":
+            job.result = status_data
+            return None
+        if status == "error":
+            return None
+
+        num_pages = status_data.get("num_pages")
+        if num_pages:
+            job.deadline = job.started_at + self.deadline(num_pages)
+        if now >= job.deadline:
+            logger.warning(f"Giving up on PDF ID {job.pdf_id} after {now - job.started_at:.0f}s")
+            return None
+
+        interval = min(self.max_interval, job.interval * 2)
+        job.interval = interval
+        percent_done = status_data.get("percent_done")
+        if percent_done:
+            if job.first_progress is None:
+                job.first_progress = (now, percent_done)
+            else:
+                first_time, first_percent = job.first_progress
+                rate = (percent_done - first_percent) / (now - first_time) if now > first_time else 0
+                if rate > 0:
+                    # Poll around the estimated completion time
+                    remaining = (100 - percent_done) / rate
+                    interval = max(self.min_interval, min(self.max_interval, remaining))
+        return min(job.deadline, now + self._jitter(interval))
+
+
+poller = MathpixPoller()
@@ -0,0 +1,107 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Thread-safe stage timers and counters.
+
+    Each timer keeps the number of runs, the total and the longest run in
+    seconds; counters are plain sums. Review entries list results someone
+    should check by hand.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.reviews = []
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            count, total, longest = self.timers.get(name, (0, 0.0, 0.0))
+            self.timers[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_review(self, entry):
+        with self.lock:
+            self.reviews.append(entry)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {
+                "timers": {
+                    name: {"count": count, "seconds": round(total, 3), "max_seconds": round(longest, 3)}
+                    for name, (count, total, longest) in sorted(self.timers.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+            if self.reviews:
+                snapshot["review"] = list(self.reviews)
+            return snapshot
+
+    def summary(self):
+        # One line per stage, for logs
+        snapshot = self.snapshot()
+        lines = [f"{name}: {timer['seconds']:.2f}s over {timer['count']}" for name, timer in snapshot["timers"].items()]
+        lines += [f"{name}: {value:g}" for name, value in snapshot["counters"].items()]
+        return "\n".join(lines)
+
+
+# Totals for the whole process, served by /metrics
+registry = Metrics()
+
+# Extra Metrics for the job running in the current context, see collect()
+current_job_metrics = contextvars.ContextVar("current_job_metrics", default=None)
+
+
+def observe(name, seconds):
+    registry.observe(name, seconds)
+    job_metrics = current_job_metrics.get()
+    if job_metrics is not None:
+        job_metrics.observe(name, seconds)
+
+
+def increment(name, value=1):
+    registry.increment(name, value)
+    job_metrics = current_job_metrics.get()
+    if job_metrics is not None:
+        job_metrics.increment(name, value)
+
+
+def review(entry):
+    # Only kept for the job being collected; the process totals would grow without bound
+    job_metrics = current_job_metrics.get()
+    if job_metrics is not None:
+        job_metrics.add_review(entry)
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+    # Everything measured inside the block, including work handed to pool
+    # threads through submit(), is also recorded in the Metrics yielded here
+    job_metrics = Metrics()
+    token = current_job_metrics.set(job_metrics)
+    try:
+        yield job_metrics
+    finally:
+        current_job_metrics.reset(token)
+
+
+def submit(executor, fn, *args, **kwargs):
+    # Pool threads do not inherit context variables, so run fn in a copy of ours
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,84 @@
+import io
+import re
+
+# A numbered line such as "12." "12)" or "(12)" starts a new question or solution
+NUMBER_PATTERN = re.compile(r'^\(?\s*([0-9]+)\s*[\).]', re.IGNORECASE)
+
+# Fully bracketed sub-question labels such as "(i)" or "(b)"
+SUB_QUESTION_PATTERN = re.compile(r'^\(\s*([ivx]+|[a-z])\s*\)', re.IGNORECASE)
+
+# Short header lines such as "Section A", "SECTION - B (1 mark each)" or "Part II:"
+# The label must be set apart from the keyword, and only a bracketed marks
+# note may follow it, so "Sections of a stem" and "Part A: State Ohm's law."
+# stay in their question
+SECTION_PATTERN = re.compile(r'^(?:section|part)(?:\s+|\s*[-:]\s*)([a-z]|[ivx]+|[0-9]+)\s*[:.\-]?\s*'
+                             r'(?:[\(\[][^\(\)\[\]]*\d[^\(\)\[\]]*[\)\]]\s*)?$', re.IGNORECASE)
+SECTION_MAX_LENGTH = 60
+
+
+def _record(lines, number, label, section, sub_questions):
+    return {
+        'text': "\n".join(lines),
+        'number': number,
+        'label': label,
+        'section': section,
+        'sub_questions': sub_questions,
+    }
+
+
+# Split lines of Mathpix text into numbered blocks, yielding one record at a time.
+# Each record has the block text, its sequential number, the number printed
+# in the paper (None for text before the first numbered line), the section
+# it appeared under and the labels of any bracketed sub-questions.
+def segment_lines(lines):
+    block = []
+    number = 1
+    label = None
+    section = None
+    block_section = None
+    sub_questions = []
+
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        match = NUMBER_PATTERN.match(line)
+        if match:
+            if block:
+                yield _record(block, number, label, block_section, sub_questions)
+                number += 1
+            block = [stripped]
+            label = match.group(1)
+            block_section = section
+            sub_questions = []
+            continue
+
+        # Cheap first-character checks keep the extra patterns off most lines
+        first = stripped[0]
+        if first in 'sSpP' and len(stripped) <= SECTION_MAX_LENGTH:
+            section_match = SECTION_PATTERN.match(stripped)
+            if section_match:
+                section = section_match.group(1).upper()
+                # Headers inside the question list are not part of the previous question
+                if label is not None:
+                    continue
+                block_section = section
+        elif first == '(':
+            sub_match = SUB_QUESTION_PATTERN.match(stripped)
+            if sub_match:
+                sub_questions.append(sub_match.group(1).lower())
+        block.append(stripped)
+
+    if block:
+        yield _record(block, number, label, block_section, sub_questions)
+
+
+def segment_file(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        yield from segment_lines(file)
+
+
+def segment_text(text):
+    return segment_lines(io.StringIO(text))
+
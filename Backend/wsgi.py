@@ -0,0 +1,3 @@
+# Entry point for production WSGI servers:
+#     gunicorn -c gunicorn.conf.py wsgi:app
+from app import app